@@ -0,0 +1,33 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+async def _run_all(items, worker, concurrency, on_result):
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    # Worker là hàm blocking (requests), chạy trong thread pool có kích thước bằng concurrency
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        async def run_one(index, item):
+            async with semaphore:
+                try:
+                    result = await loop.run_in_executor(executor, worker, item)
+                    return index, item, result, None
+                except Exception as e:
+                    return index, item, None, e
+
+        tasks = [asyncio.create_task(run_one(i, item)) for i, item in enumerate(items)]
+
+        # Trả kết quả về ngay khi từng item hoàn thành, không đợi cả batch
+        for finished in asyncio.as_completed(tasks):
+            index, item, result, error = await finished
+            on_result(index, item, result, error)
+
+def run_concurrently(items, worker, concurrency, on_result):
+    """Chạy worker(item) cho nhiều item cùng lúc, tối đa `concurrency` item song song.
+
+    on_result(index, item, result, error) được gọi tuần tự trên event loop
+    theo thứ tự hoàn thành; error là exception nếu worker lỗi, ngược lại là None.
+    """
+    if concurrency < 1:
+        raise ValueError("concurrency must be >= 1")
+    asyncio.run(_run_all(list(items), worker, concurrency, on_result))
@@ -0,0 +1,81 @@
+import asyncio
+from contextlib import asynccontextmanager
+from playwright.async_api import async_playwright
+from crawler.config import BROWSER_MAX_CONTEXTS, BROWSER_PAGES_PER_CONTEXT, BROWSER_BLOCK_RESOURCES
+
+# Tài nguyên không cần cho việc bắt request/response GraphQL
+BLOCKED_RESOURCE_TYPES = {"image", "media", "font"}
+BLOCKED_URL_PATTERNS = ("google-analytics.com", "googletagmanager.com", "doubleclick.net", "facebook.net", "/tracking/")
+
+async def _block_heavy_resources(route):
+    request = route.request
+    if request.resource_type in BLOCKED_RESOURCE_TYPES or any(p in request.url for p in BLOCKED_URL_PATTERNS):
+        await route.abort()
+    else:
+        await route.continue_()
+
+class BrowserPool:
+    """Giữ một process Chromium sống suốt lần chạy và cấp context cô lập cho từng tác vụ.
+
+    Tối đa `max_contexts` context được dùng cùng lúc. Context được tái sử dụng
+    và đóng sau `pages_per_context` lượt dùng để giới hạn bộ nhớ. Nếu `block_resources`
+    thì ảnh, media, font và script analytics bị chặn ở mức context.
+    """
+
+    def __init__(self, headless=True, max_contexts=BROWSER_MAX_CONTEXTS, pages_per_context=BROWSER_PAGES_PER_CONTEXT,
+                 block_resources=BROWSER_BLOCK_RESOURCES):
+        self.headless = headless
+        self.block_resources = block_resources
+        self.max_contexts = max_contexts
+        self.pages_per_context = pages_per_context
+        self._playwright = None
+        self._browser = None
+        self._semaphore = None
+        self._idle = []  # [(context, số lượt đã dùng)]
+
+    async def start(self):
+        self._playwright = await async_playwright().start()
+        self._browser = await self._playwright.chromium.launch(headless=self.headless)
+        self._semaphore = asyncio.Semaphore(self.max_contexts)
+        return self
+
+    async def close(self):
+        for context, _ in self._idle:
+            await context.close()
+        self._idle = []
+        if self._browser:
+            await self._browser.close()
+        if self._playwright:
+            await self._playwright.stop()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def _acquire_context(self):
+        if self._idle:
+            return self._idle.pop()
+        context = await self._browser.new_context()
+        if self.block_resources:
+            await context.route("**/*", _block_heavy_resources)
+        return context, 0
+
+    async def _release_context(self, context, uses):
+        if uses >= self.pages_per_context:
+            await context.close()
+        else:
+            self._idle.append((context, uses))
+
+    @asynccontextmanager
+    async def page(self):
+        # Cấp một page mới trong một context riêng, trả context về pool khi xong
+        async with self._semaphore:
+            context, uses = await self._acquire_context()
+            page = await context.new_page()
+            try:
+                yield page
+            finally:
+                await page.close()
+                await self._release_context(context, uses + 1)
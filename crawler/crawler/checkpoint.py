@@ -0,0 +1,69 @@
+import glob
+import json
+import os
+from crawler.config import CHECKPOINT_EVERY
+
+def _write_json_atomic(data, path):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def checkpoint_state_file(output_filename):
+    return f"{output_filename}.checkpoint"
+
+def find_latest_checkpoint(output_dir, prefix, scope=None):
+    # Tìm lần chạy dở dang gần nhất (cùng prefix file output và cùng scope), trả về (output_filename, completed)
+    candidates = glob.glob(os.path.join(output_dir, f"{prefix}_*.checkpoint"))
+    for state_file in sorted(candidates, key=os.path.getmtime, reverse=True):
+        try:
+            with open(state_file, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"[WARNING] Could not read checkpoint {state_file}: {e}")
+            continue
+        if state.get("scope") == scope:
+            return state["output"], set(state.get("completed", []))
+    return None, set()
+
+class Checkpointer:
+    """Ghi record ra file output ngay khi có và chốt checkpoint sau mỗi `every` listing.
+
+    Ở mỗi checkpoint, file output được flush xuống đĩa và danh sách listing đã xong
+    của lần chạy được lưu (ghi atomic) trong `<output>.checkpoint` để có thể chạy
+    tiếp với --resume sau khi bị dừng giữa chừng. Bộ nhớ chỉ giữ tối đa một lô record.
+    """
+
+    def __init__(self, writer, every=CHECKPOINT_EVERY, on_flush=None, completed=None, scope=None):
+        self.output_filename = writer.filename
+        self.scope = scope
+        self.state_file = checkpoint_state_file(writer.filename)
+        self._writer = writer
+        self._on_flush = on_flush
+        self.every = every
+        self.completed = set(completed or ())
+        self._buffer = []
+
+    def add(self, record):
+        self._writer.write(record)
+        self._buffer.append(record)
+        if len(self._buffer) >= self.every:
+            self.flush()
+
+    def flush(self):
+        if not self._buffer:
+            return
+        records, self._buffer = self._buffer, []
+        self._writer.flush()
+        self.completed.update(record["listing_id"] for record in records)
+        _write_json_atomic({"output": self.output_filename, "scope": self.scope, "completed": sorted(self.completed)}, self.state_file)
+        if self._on_flush:
+            self._on_flush(records)
+        print(f"[CHECKPOINT] Saved {len(records)} records ({len(self.completed)} done in this run)")
+
+    def finish(self):
+        # Chốt lô cuối, đóng file output và xoá trạng thái checkpoint vì lần chạy đã hoàn tất
+        self.flush()
+        self._writer.close()
+        if os.path.exists(self.state_file):
+            os.remove(self.state_file)
@@ -1,3 +1,99 @@
 USER_AGENT = "Mozilla/5.0"
 API_DOMAIN = "https://www.airbnb.com.vn"
 API_KEY = ""
+
+# HTTP connection pool
+POOL_MAXSIZE = 32
+REQUEST_TIMEOUT = 30
+
+# Số listing được fetch song song trong một lần chạy
+FETCH_CONCURRENCY = 8
+
+# Rate limit cho mỗi GraphQL operation (request/giây), điều chỉnh theo AIMD
+RATE_LIMIT_INITIAL = 2.0
+RATE_LIMIT_MIN = 0.2
+RATE_LIMIT_MAX = 20.0
+RATE_LIMIT_INCREASE = 0.5
+RATE_LIMIT_DECREASE = 0.5
+RATE_LIMIT_COOLDOWN = 2.0
+
+# Retry với exponential backoff + jitter
+RETRY_MAX_ATTEMPTS = 4
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 30.0
+# Mỗi request gốc cho phép thêm 0.2 retry (tối đa ~20% request là retry)
+RETRY_BUDGET_RATIO = 0.2
+RETRY_BUDGET_MIN_TOKENS = 10
+RETRY_BUDGET_MAX_TOKENS = 100
+
+# Circuit breaker cho mỗi operation
+BREAKER_FAILURE_THRESHOLD = 10
+BREAKER_RESET_TIMEOUT = 60.0
+
+# Số khoảng ngày stayCheckout được thử song song trong mỗi đợt
+PRICE_PROBE_WAVE = 3
+
+# Số tháng calendar được lấy để chọn ngày checkin khi dùng chế độ --use-calendar
+PRICE_CALENDAR_MONTHS = 2
+
+# Lưu nguyên body response GraphQL vào output/raw_payloads để xử lý lại offline
+RAW_STORE_ENABLED = True
+
+# Thời gian (giây) cache GraphQL hash còn được dùng trước khi bắt buộc lấy lại bằng Playwright
+HASH_CACHE_TTL = 24 * 60 * 60
+
+# Browser pool dùng chung cho việc lấy hash và tìm listing IDs
+BROWSER_MAX_CONTEXTS = 4
+BROWSER_PAGES_PER_CONTEXT = 20
+# Chặn ảnh, media, font và analytics trong browser để trang tải nhanh hơn
+BROWSER_BLOCK_RESOURCES = True
+# Thời gian tối đa (ms) chờ response StaysSearch sau khi tìm kiếm hoặc chuyển trang
+SEARCH_RESPONSE_TIMEOUT = 20000
+# Số tỉnh được tìm kiếm song song trong cùng một Chromium
+ID_SEARCH_CONCURRENCY = 3
+
+# Gọi thẳng StaysSearch API theo cursor thay vì bấm "Tiếp theo" trên giao diện
+ID_SEARCH_USE_API = True
+# Số trang kết quả tối đa của một lần tìm kiếm
+STAYS_SEARCH_MAX_PAGES = 15
+
+# Chia khung bản đồ của tỉnh thành các ô nhỏ khi kết quả tìm kiếm bị giới hạn số trang
+ID_SEARCH_TILING = True
+# Số lần chia đôi tối đa theo mỗi chiều (mỗi lần chia một ô thành 4 ô)
+TILE_MAX_DEPTH = 6
+# Số ô được tìm kiếm song song
+TILE_SEARCH_CONCURRENCY = 4
+
+# Frontier: số lần lỗi tối đa trước khi listing bị đánh dấu dead ở một stage
+FRONTIER_MAX_ATTEMPTS = 3
+# Thời gian (giây) sau khi fetch thành công thì listing cần được crawl lại, theo stage
+FRONTIER_REFETCH_AFTER = {
+    "listing_info": 7 * 24 * 60 * 60,
+    "review": 7 * 24 * 60 * 60,
+    "calendar": 24 * 60 * 60
+}
+
+# Ghi kết quả ra file output (checkpoint) sau mỗi bấy nhiêu listing
+CHECKPOINT_EVERY = 100
+
+# Lưu output các lần chạy vào output/segments/<loại> (segment nén, bất biến) thay vì giữ file JSON Lines
+SEGMENT_STORE_ENABLED = True
+# Compact khi số segment của một loại đạt ngưỡng này
+SEGMENT_COMPACT_THRESHOLD = 8
+# Mức nén zstd cho segment (chỉ dùng khi có package zstandard)
+SEGMENT_ZSTD_LEVEL = 3
+
+# Các section (__typename) được lấy lại khi chạy run_fetch_listing_info --refresh; giá luôn được lấy lại
+LISTING_REFRESH_SECTIONS = ["StayPdpReviewsSection"]
+
+# Reviews được lấy theo trang (mới nhất trước), dừng ở review đã có trong MongoDB
+REVIEW_PAGE_SIZE = 24
+# Số trang reviews tối đa cho một listing trong một lần chạy
+REVIEW_MAX_PAGES = 50
+# Bỏ qua request reviews của listing có số review trên PDP không đổi kể từ lần crawl reviews trước
+REVIEW_SKIP_UNCHANGED_COUNT = True
+
+# Calendar: số tháng của cửa sổ calendar (bắt đầu từ tháng hiện tại)
+CALENDAR_WINDOW_MONTHS = 12
+# Số tháng gần nhất luôn được lấy lại ở chế độ incremental; các tháng xa chỉ lấy khi mới xuất hiện trong cửa sổ
+CALENDAR_NEAR_MONTHS = 2
@@ -1,52 +1,79 @@
-import json, requests
 from datetime import datetime
-from .headers import build_headers
+from .config import CALENDAR_NEAR_MONTHS, CALENDAR_WINDOW_MONTHS
+from .http_client import get_default_client
+from .records import CalendarDay, CalendarMonth
 
-def fetch_calendar(listing_id, hash_val, encoded_id, domain):
-    url = f"{domain}/api/v3/PdpAvailabilityCalendar/{hash_val}"
+def fetch_calendar(listing_id, hash_val, encoded_id, domain, client=None, count=12, month=None, year=None):
+    # Lấy `count` tháng liên tiếp bắt đầu từ month/year (mặc định tháng hiện tại)
+    client = client or get_default_client()
     variables = {
         "request": {
-            "count": 12,
+            "count": count,
             "listingId": listing_id,
-            "month": datetime.today().month,
-            "year": datetime.today().year
+            "month": month or datetime.today().month,
+            "year": year or datetime.today().year
         }
     }
-    extensions = {"persistedQuery": {"version": 1, "sha256Hash": hash_val}}
-
-    r = requests.get(url, headers=build_headers(listing_id, hash_val), params={
-                    "operationName": "PdpAvailabilityCalendar",
-                    "locale": "vi",
-                    "currency": "VND",
-                    "variables": json.dumps(variables),
-                    "extensions": json.dumps(extensions)
-    })
-    r.raise_for_status()
-    return r.json().get("data", {}).get("merlin", {}).get("pdpAvailabilityCalendar", {}).get("calendarMonths", [])
+    payload = client.graphql("PdpAvailabilityCalendar", hash_val, listing_id, variables, domain)
+    return parse_calendar_response(payload)
+
+def _add_months(year, month, offset):
+    index = year * 12 + month - 1 + offset
+    return index // 12, index % 12 + 1
+
+def incremental_ranges(last_fetch, today=None, near_months=CALENDAR_NEAR_MONTHS, window=CALENDAR_WINDOW_MONTHS):
+    """Các khoảng tháng (year, month, count) cần lấy lại khi đã có calendar lấy lúc last_fetch.
+
+    Gồm near_months tháng gần nhất (thay đổi thường xuyên) và các tháng cuối cửa sổ
+    mới xuất hiện kể từ last_fetch. Tháng ở giữa giữ nguyên như đã lưu.
+    """
+    today = today or datetime.today()
+    ranges = [(today.year, today.month, near_months)]
+    months_since = (today.year * 12 + today.month) - (last_fetch.year * 12 + last_fetch.month)
+    new_months = min(max(months_since, 0), window - near_months)
+    if new_months:
+        year, month = _add_months(today.year, today.month, window - new_months)
+        ranges.append((year, month, new_months))
+    return ranges
+
+def fetch_calendar_window(listing_id, hash_val, encoded_id, domain, client=None, last_fetch=None,
+                          near_months=CALENDAR_NEAR_MONTHS, window=CALENDAR_WINDOW_MONTHS):
+    # Lấy toàn bộ cửa sổ nếu chưa có lần fetch trước, ngược lại chỉ lấy các tháng trong incremental_ranges
+    if last_fetch is None:
+        return fetch_calendar(listing_id, hash_val, encoded_id, domain, client, count=window)
+    calendar_months = []
+    for year, month, count in incremental_ranges(last_fetch, None, near_months, window):
+        calendar_months.extend(fetch_calendar(listing_id, hash_val, encoded_id, domain, client, count, month, year))
+    return calendar_months
+
+def merge_calendar_months(stored_months, new_months, today=None):
+    # Ghép các tháng mới lấy vào calendar đã lưu theo (year, month), bỏ các tháng đã qua
+    today = today or datetime.today()
+    merged = {(month.get("year"), month.get("month")): month for month in stored_months}
+    for month in new_months:
+        merged[(month.get("year"), month.get("month"))] = month
+    current = (today.year, today.month)
+    return [merged[key] for key in sorted(merged) if key[0] is not None and key[1] is not None and key >= current]
+
+# Lấy danh sách calendarMonths từ response PdpAvailabilityCalendar
+def parse_calendar_response(payload):
+    return payload.get("data", {}).get("merlin", {}).get("pdpAvailabilityCalendar", {}).get("calendarMonths", [])
 
 def extract_calendar_data(calendar_months, listing_id):
     calendars = []
 
     for month_data in calendar_months:
-        month_obj = {
-            "month": month_data.get("month"),
-            "year": month_data.get("year"),
-            "days": []
-        }
+        days = [CalendarDay(
+            day.get("calendarDate"),
+            day.get("available"),
+            day.get("availableForCheckin"),
+            day.get("availableForCheckout"),
+            day.get("bookable"),
+            day.get("minNights"),
+            day.get("maxNights"),
+            day.get("price", {}).get("localPriceFormatted")
+        ) for day in month_data.get("days", [])]
+
+        calendars.append(CalendarMonth(month_data.get("month"), month_data.get("year"), days))
 
-        for day in month_data.get("days", []):
-            day_obj = {
-                "calendarDate": day.get("calendarDate"),
-                "available": day.get("available"),
-                "availableForCheckin": day.get("availableForCheckin"),
-                "availableForCheckout": day.get("availableForCheckout"),
-                "bookable": day.get("bookable"),
-                "minNights": day.get("minNights"),
-                "maxNights": day.get("maxNights"),
-                "priceFormatted": day.get("price", {}).get("localPriceFormatted")
-            }
-            month_obj["days"].append(day_obj)
-
-        calendars.append(month_obj)
-
-    return calendars
\ No newline at end of file
+    return calendars
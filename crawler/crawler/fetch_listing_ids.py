@@ -1,5 +1,10 @@
-import re, time, pymysql, os
-from playwright.sync_api import sync_playwright
+import asyncio, re, pymysql
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+from crawler.browser_pool import BrowserPool
+from crawler.config import ID_SEARCH_CONCURRENCY, ID_SEARCH_USE_API, ID_SEARCH_TILING, SEARCH_RESPONSE_TIMEOUT
+from crawler.frontier import Frontier
+from crawler.http_client import CrawlerClient
+from crawler.stays_search import build_search_template, extract_listing_ids, iter_listing_ids, search_by_tiles
 
 # --- Config kết nối MySQL ---
 MYSQL = dict(host='localhost', user='root', password='', db='a2airbnb', charset='utf8mb4')
@@ -12,138 +17,127 @@ def get_locations_from_db():
     con.close()
     return [row[0] for row in rows]
 
-# --- Lưu listing IDs chưa có ---
-def append_listing_ids_to_txt(listing_ids, filename):
-    if not listing_ids:
-        print("No IDs to save")
-        return
-
-    # Lọc bỏ các giá trị None hoặc "None"
-    filtered_ids = [lid for lid in listing_ids if lid is not None and lid != "None" and str(lid).strip() != ""]
-
-    if not filtered_ids:
-        print("No valid IDs to save after filtering")
-        return
-
-    existing_ids = set()
-    if os.path.exists(filename):
-        with open(filename, mode="r", encoding="utf-8") as f:
-            existing_ids = set(line.strip() for line in f if line.strip())
+# --- Lưu listing IDs chưa có vào frontier ---
+def save_listing_ids(frontier, listing_ids, province):
+    added = frontier.add_listings(listing_ids, province)
+    print(f"Added {added} new listing_id(s) for {province} to {frontier.path}")
 
-    new_ids = [lid for lid in filtered_ids if lid not in existing_ids]
-
-    # Nối vào cuối file
-    with open(filename, mode="a", encoding="utf-8") as f:
-        for lid in new_ids:
-            f.write(f"{lid}\n")
-
-    print(f"Appended {len(new_ids)} new listing_id(s) to {filename}")
+def is_stays_search_response(resp):
+    return '/api/v3/StaysSearch/' in resp.url and resp.request.method == 'POST'
 
 # --- Mô phỏng nhập vào thanh tìm kiếm ---
-def simulate_user_search(page, location_name):
-    page.goto("https://www.airbnb.com.vn/", timeout=60000)
-    page.wait_for_load_state("load")
+async def simulate_user_search(page, location_name):
+    """Tìm kiếm như người dùng, trả về response StaysSearch đầu tiên (hoặc None nếu quá thời gian chờ)."""
+    await page.goto("https://www.airbnb.com.vn/", timeout=60000)
+    await page.wait_for_load_state("load")
     
     # Đóng dialog quảng cáo nếu hiển thị
     try:
-        page.get_by_role("dialog", name=re.compile("Giờ đây bạn sẽ thấy một mức")).click(timeout=5000)
-        page.get_by_role("button", name="Đóng").click(timeout=5000)
+        await page.get_by_role("dialog", name=re.compile("Giờ đây bạn sẽ thấy một mức")).click(timeout=5000)
+        await page.get_by_role("button", name="Đóng").click(timeout=5000)
     except:
         print("Không tìm thấy dialog, tiếp tục script.")
 
     # Click vào ô tìm kiếm chính
     search_input = page.get_by_test_id("structured-search-input-field-query")
-    search_input.click()
-    search_input.fill(location_name)
+    await search_input.click()
+    await search_input.fill(location_name)
 
-    # Click nút tìm kiếm
+    # Click nút tìm kiếm và chờ đúng response StaysSearch thay vì chờ cố định
     search_button = page.get_by_test_id("structured-search-input-search-button")
-    search_button.click()
-
-    # Chờ kết quả trả về (hoặc API được gọi)
-    page.wait_for_timeout(5000)
+    try:
+        async with page.expect_response(is_stays_search_response, timeout=SEARCH_RESPONSE_TIMEOUT) as response_info:
+            await search_button.click()
+        return await response_info.value
+    except PlaywrightTimeoutError:
+        print("[WARNING] Không bắt được API response.")
+        return None
 
 # --- Lặp qua các trang và lấy thêm listing IDs ---
-def loop_through_each_page(name):
+async def loop_through_each_page(pool, name):
     listing_ids = set()
 
-    with sync_playwright() as p:
-        browser = p.chromium.launch(headless=False)
-        page = browser.new_page()
-
-        # Danh sách response json mỗi trang
-        captured_json = []
-
-        # Bật lắng nghe request (nhưng chỉ giữ một cái gần nhất khi gọi API)
-        def on_response(resp):
-            if '/api/v3/StaysSearch/' in resp.url and resp.request.method == 'POST':
-                try:
-                    json_data = resp.json()
-                    captured_json.append(json_data)
-                    print(f"[CAPTURED] {resp.url}")
-                except Exception as e:
-                    print(f"[ERROR] Failed to parse response: {e}")
-
-        page.on("response", on_response)
-
+    async with pool.page() as page:
         # Tìm kiếm lần đầu tiên
-        simulate_user_search(page, name)
+        response = await simulate_user_search(page, name)
 
         # Lặp tối đa 5 trang
         for page_index in range(5):
-            print(f"[INFO] --- Page {page_index+1} ---")
-
-            # Đợi response được bắt (API StaysSearch)
-            for _ in range(30):  # timeout ~6s
-                if captured_json:
-                    break
-                time.sleep(0.2)
-
-            if not captured_json:
-                print("[WARNING] Không bắt được API response.")
+            if response is None:
                 break
+            print(f"[INFO] --- {name}: Page {page_index+1} ---")
+            print(f"[CAPTURED] {response.url}")
 
             # Lấy listingId từ json response vừa bắt
             try:
-                response_data = captured_json.pop(0)
-                stays = response_data.get("data", {})\
-                                     .get("presentation", {})\
-                                     .get("staysSearch", {})\
-                                     .get("mapResults", {})\
-                                     .get("staysInViewport", [])
-                new_ids = [stay["listingId"] for stay in stays if "listingId" in stay and stay["listingId"] is not None and stay["listingId"] != "None"]
+                new_ids = extract_listing_ids(await response.json())
                 print(f"[INFO] Found {len(new_ids)} listingId(s)")
                 listing_ids.update(new_ids)
             except Exception as e:
                 print(f"[ERROR] Extracting listingIds: {e}")
 
-            # Tìm và nhấn nút "Tiếp theo"
+            # Tìm và nhấn nút "Tiếp theo", trang mới xong ngay khi response StaysSearch về
             try:
                 next_btn = page.get_by_role("link", name=re.compile("Tiếp theo", re.IGNORECASE))
-                if next_btn.is_visible():
-                    next_btn.click()
-                    page.wait_for_timeout(5000)  # đợi trang mới
-                else:
+                if not await next_btn.is_visible():
                     print("[INFO] No more pages.")
                     break
+                async with page.expect_response(is_stays_search_response, timeout=SEARCH_RESPONSE_TIMEOUT) as response_info:
+                    await next_btn.click()
+                response = await response_info.value
             except Exception as e:
                 print(f"[WARNING] Next button error: {e}")
                 break
 
-        browser.close()
-
     return listing_ids
 
-
-def main():
-    for province in get_locations_from_db():
-        print(f"\nSearching for: {province}")
-        ids = loop_through_each_page(province)
-        if ids:
-            print(f"\nFound {len(ids)} listings for {province}")
-            append_listing_ids_to_txt(ids, f"output/listing_ids/listing_ids_{province}.txt")
+# --- Bắt request StaysSearch đầu tiên để gọi lại trực tiếp qua API ---
+async def capture_search_template(pool, name):
+    async with pool.page() as page:
+        response = await simulate_user_search(page, name)
+        if response is None:
+            return None
+        try:
+            return build_search_template(response.request)
+        except Exception as e:
+            print(f"[ERROR] Failed to capture StaysSearch request: {e}")
+            return None
+
+async def search_province_via_api(pool, client, name, tiling=ID_SEARCH_TILING):
+    # Chỉ dùng browser một lần để lấy request mẫu, các trang sau gọi thẳng API
+    template = await capture_search_template(pool, name)
+    if not template:
+        print(f"[WARNING] Could not capture StaysSearch request for {name}, falling back to UI paging")
+        return await loop_through_each_page(pool, name)
+
+    if tiling:
+        return await asyncio.to_thread(search_by_tiles, template, client)
+    return await asyncio.to_thread(lambda: set(iter_listing_ids(template, client)))
+
+async def search_province(pool, province, frontier, client=None, tiling=ID_SEARCH_TILING):
+    print(f"\nSearching for: {province}")
+    try:
+        if client is not None:
+            ids = await search_province_via_api(pool, client, province, tiling)
         else:
-            print(f"No listings found for {province}")
+            ids = await loop_through_each_page(pool, province)
+    except Exception as e:
+        print(f"[ERROR] Search failed for {province}: {e}")
+        return
+    if ids:
+        print(f"\nFound {len(ids)} listings for {province}")
+        save_listing_ids(frontier, ids, province)
+    else:
+        print(f"No listings found for {province}")
+
+async def search_provinces(provinces, concurrency=ID_SEARCH_CONCURRENCY, use_api=ID_SEARCH_USE_API, tiling=ID_SEARCH_TILING):
+    # Một Chromium cho tất cả tỉnh, tối đa `concurrency` tỉnh được tìm cùng lúc
+    with Frontier() as frontier, CrawlerClient() as client:
+        async with BrowserPool(headless=False, max_contexts=concurrency) as pool:
+            await asyncio.gather(*(search_province(pool, province, frontier, client if use_api else None, tiling) for province in provinces))
+
+def main(concurrency=ID_SEARCH_CONCURRENCY, use_api=ID_SEARCH_USE_API, tiling=ID_SEARCH_TILING):
+    asyncio.run(search_provinces(get_locations_from_db(), concurrency, use_api, tiling))
 
 if __name__ == "__main__":
     main()
@@ -1,10 +1,26 @@
-import json, requests
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
-from .headers import build_headers
+from .config import PRICE_PROBE_WAVE
+from .http_client import get_default_client
+from .records import Amenity, AmenityGroup, Description, Highlight, Image, Rating, RoomTourItem
+from .price_probe import DEFAULT_DATE_RANGES
+from .retry import CircuitOpenError
 
-# Fetch listing info
-def fetch_listing_info(listing_id, hash_val, encoded_id, domain):
-    url = f"{domain}/api/v3/StaysPdpSections/{hash_val}"
+# __typename -> sectionId trong pdpSectionsRequest.sectionIds, dùng khi chỉ lấy một số section
+SECTION_IDS = {
+    "PhotoTourModalSection": "PHOTO_TOUR_SCROLLABLE_MODAL",
+    "StayPdpReviewsSection": "REVIEWS_DEFAULT",
+    "PoliciesSection": "POLICIES_DEFAULT",
+    "PdpHighlightsSection": "HIGHLIGHTS_DEFAULT",
+    "GeneralListContentSection": "DESCRIPTION_DEFAULT",
+    "AmenitiesSection": "AMENITIES_DEFAULT",
+    "LocationSection": "LOCATION_DEFAULT"
+}
+
+# Fetch listing info; section_types là list __typename nếu chỉ cần lấy lại một số section
+def fetch_listing_info(listing_id, hash_val, encoded_id, domain, client=None, section_types=None):
+    client = client or get_default_client()
     variables = {
         "id": encoded_id,
         "wishlistTenantIntegrationEnabled": True,
@@ -19,106 +35,267 @@ def fetch_listing_info(listing_id, hash_val, encoded_id, domain):
             "p3ImpressionId": "p3_dummy"
         }
     }
-    extensions = {"persistedQuery": {"version": 1, "sha256Hash": hash_val}}
-
-    r = requests.get(url, headers=build_headers(listing_id, hash_val), params={
-        "operationName": "StaysPdpSections",
-        "locale": "vi",
-        "currency": "VND",
-        "variables": json.dumps(variables),
-        "extensions": json.dumps(extensions)
-    })
-    r.raise_for_status()
-    return r.json().get("data", {}).get("presentation", {}).get("stayProductDetailPage", {}).get("sections", {})
-
-# Fetch price
-def fetch_price(listing_id, hash_val, encoded_id, domain):
-    url = f"{domain}/api/v3/stayCheckout/{hash_val}"
-    
-    # Danh sách các khoảng thời gian để thử
-    date_ranges = [
-        # Thử các khoảng thời gian khác nhau
-        (7, 8),   # 7-8 ngày tới
-        (10, 11), # 10-11 ngày tới
-        (14, 15), # 14-15 ngày tới  
-        (20, 21), # 20-21 ngày tới
-        (30, 31), # 30-31 ngày tới
-        (45, 46), # 45-46 ngày tới
-        (60, 61), # 60-61 ngày tới
-        (90, 91), # 90-91 ngày tới
-        (120, 121), # 120-121 ngày tới
-        (150, 151), # 150-151 ngày tới
-        (180, 181) # 180-181 ngày tới
-    ]
-    
-    for i, (checkin_days, checkout_days) in enumerate(date_ranges):
+    if section_types:
+        variables["pdpSectionsRequest"]["sectionIds"] = [SECTION_IDS[section_type] for section_type in section_types]
+    payload = client.graphql("StaysPdpSections", hash_val, listing_id, variables, domain)
+    return parse_listing_info_response(payload)
+
+# Lấy phần sections từ response StaysPdpSections (dùng cả khi xử lý lại raw payload)
+def parse_listing_info_response(payload):
+    return payload.get("data", {}).get("presentation", {}).get("stayProductDetailPage", {}).get("sections", {})
+
+# Gọi stayCheckout cho một cặp ngày, trả về priceItems (list rỗng nếu không có giá)
+def _probe_price(listing_id, hash_val, encoded_id, domain, client, checkin, checkout):
+    variables = {
+        "input": {
+            "businessTravel": {"workTrip": False},
+            "checkinDate": checkin,
+            "checkoutDate": checkout,
+            "guestCounts": {
+                "numberOfAdults": 1,
+                "numberOfChildren": 0,
+                "numberOfInfants": 0,
+                "numberOfPets": 0
+            },
+            "guestCurrencyOverride": "VND",
+            "listingDetail": {},
+            "lux": {},
+            "metadata": {"internalFlags": ["LAUNCH_LOGIN_PHONE_AUTH"]},
+            "org": {},
+            "productId": encoded_id,
+            "addOn": {"carbonOffsetParams": {"isSelected": False}},
+            "quickPayData": None
+        }
+    }
+
+    full_response = client.graphql("stayCheckout", hash_val, listing_id, variables, domain)
+    return parse_price_response(full_response)
+
+# Lấy priceItems từ response stayCheckout
+def parse_price_response(full_response):
+    return full_response.get("data", {}).get("presentation", {}).get("stayCheckout", {}).get("sections", {}) \
+                .get("temporaryQuickPayData", {}).get("bootstrapPayments", {}).get("productPriceBreakdown", {}) \
+                .get("priceBreakdown", {}).get("priceItems", [])
+
+# Gửi song song từng đợt wave_size cặp ngày, cặp nào có giá trước thì dùng.
+# candidates là list (checkin, checkout, date_range); date_range là khoảng offset
+# để ghi thống kê, None nếu cặp ngày lấy từ calendar.
+def _probe_candidates(listing_id, hash_val, encoded_id, domain, client, candidates, probe_stats, scope, wave_size):
+    for wave_start in range(0, len(candidates), wave_size):
+        wave = candidates[wave_start:wave_start + wave_size]
+        print(f"[INFO] Trying {', '.join(f'({checkin} -> {checkout})' for checkin, checkout, _ in wave)} for listing {listing_id}")
+
+        executor = ThreadPoolExecutor(max_workers=len(wave))
+        futures = {}
+        for checkin, checkout, date_range in wave:
+            future = executor.submit(_probe_price, listing_id, hash_val, encoded_id, domain, client, checkin, checkout)
+            futures[future] = (checkin, checkout, date_range)
+
         try:
-            print(f"[INFO] Trying ({checkin_days}-{checkout_days}) for listing {listing_id}")
-            
-            # Tạo variables cho request
-            checkin = (datetime.today() + timedelta(days=checkin_days)).strftime("%Y-%m-%d")
-            checkout = (datetime.today() + timedelta(days=checkout_days)).strftime("%Y-%m-%d")
-            variables = {
-                "input": {
-                    "businessTravel": {"workTrip": False},
-                    "checkinDate": checkin,
-                    "checkoutDate": checkout,
-                    "guestCounts": {
-                        "numberOfAdults": 1,
-                        "numberOfChildren": 0,
-                        "numberOfInfants": 0,
-                        "numberOfPets": 0
-                    },
-                    "guestCurrencyOverride": "VND",
-                    "listingDetail": {},
-                    "lux": {},
-                    "metadata": {"internalFlags": ["LAUNCH_LOGIN_PHONE_AUTH"]},
-                    "org": {},
-                    "productId": encoded_id,
-                    "addOn": {"carbonOffsetParams": {"isSelected": False}},
-                    "quickPayData": None
-                }
-            }
-            
-            extensions = {"persistedQuery": {"version": 1, "sha256Hash": hash_val}}
-
-            r = requests.get(url, headers=build_headers(listing_id, hash_val), params={
-                "operationName": "stayCheckout",
-                "locale": "vi",
-                "currency": "VND",
-                "variables": json.dumps(variables),
-                "extensions": json.dumps(extensions)
-            })
-            r.raise_for_status()
-            
-            full_response = r.json()
-            
-            # Lấy dữ liệu từ response
-            price_items = full_response.get("data", {}).get("presentation", {}).get("stayCheckout", {}).get("sections", {}) \
-                        .get("temporaryQuickPayData", {}).get("bootstrapPayments", {}).get("productPriceBreakdown", {}) \
-                        .get("priceBreakdown", {}).get("priceItems", [])
-            
-            # Kiểm tra xem có dữ liệu không
-            if price_items:
-                return price_items
-            else:
-                continue
-                
-        except Exception as e:
-            continue
-                
-    
+            for future in as_completed(futures):
+                checkin, checkout, date_range = futures[future]
+                try:
+                    price_items = future.result()
+                except CircuitOpenError:
+                    # stayCheckout đang bị ngắt mạch, thử các khoảng ngày khác cũng vô ích
+                    raise
+                except Exception as e:
+                    print(f"[WARNING] Price request ({checkin} -> {checkout}) failed for listing {listing_id}: {e}")
+                    continue
+
+                if probe_stats and date_range:
+                    probe_stats.record(listing_id, scope, date_range, bool(price_items))
+                if price_items:
+                    return price_items
+        finally:
+            # Huỷ các probe chưa chạy, không chờ các probe đang bay
+            executor.shutdown(wait=False, cancel_futures=True)
+    return []
+
+# Fetch price; thiếu giá không làm hỏng listing, kể cả khi stayCheckout đang bị ngắt mạch
+def fetch_price(listing_id, hash_val, encoded_id, domain, client=None, probe_stats=None, scope=None,
+                wave_size=PRICE_PROBE_WAVE, stay_dates=None):
+    client = client or get_default_client()
+    try:
+        return _fetch_price(listing_id, hash_val, encoded_id, domain, client, probe_stats, scope, wave_size, stay_dates)
+    except CircuitOpenError as e:
+        print(f"[WARNING] Skipping price of listing {listing_id}: {e}")
+        return []
+
+def _fetch_price(listing_id, hash_val, encoded_id, domain, client, probe_stats, scope, wave_size, stay_dates):
+
+    # Cặp ngày lấy từ calendar của listing (chắc chắn đặt được) được thử trước
+    if stay_dates:
+        candidates = [(checkin, checkout, None) for checkin, checkout in stay_dates]
+        price_items = _probe_candidates(listing_id, hash_val, encoded_id, domain, client,
+                                        candidates, probe_stats, scope, wave_size)
+        if price_items:
+            return price_items
+        print(f"[WARNING] Calendar dates gave no price for listing {listing_id}, falling back to date offsets")
+
+    # Thứ tự thử được học từ các lần chạy trước (nếu có probe_stats)
+    date_ranges = probe_stats.order(listing_id, scope) if probe_stats else list(DEFAULT_DATE_RANGES)
+    today = datetime.today()
+    candidates = [(
+        (today + timedelta(days=checkin_days)).strftime("%Y-%m-%d"),
+        (today + timedelta(days=checkout_days)).strftime("%Y-%m-%d"),
+        (checkin_days, checkout_days)
+    ) for checkin_days, checkout_days in date_ranges]
+
+    price_items = _probe_candidates(listing_id, hash_val, encoded_id, domain, client,
+                                    candidates, probe_stats, scope, wave_size)
+    if price_items:
+        return price_items
+
     # Nếu tất cả đều thất bại, trả về list rỗng
     print(f"[ERROR] All attempts failed for getting price of listing {listing_id}")
     return []
 
 # Extract data
-def extract_listing_data(info, price, listing_id):
+# --- Xử lý từng loại section của StaysPdpSections, mỗi hàm ghi vào `data` ---
+def _extract_photo_tour(section, data):
+    # Images
+    media_items = section.get("mediaItems") or []
+    for media in media_items:
+        if media and media.get("__typename") == "Image":
+            data["images"].append(Image(
+                media.get("id"),
+                media.get("orientation"),
+                media.get("accessibilityLabel"),
+                media.get("baseUrl")
+            ))
+
+    embed = section.get("shareSave", {}).get("embedData", {})
+    if embed:
+        data["apartment_info"].update({
+            "id": embed.get("id"),
+            "name": embed.get("name"),
+            "personCapacity": embed.get("personCapacity"),
+            "pictureUrl": embed.get("pictureUrl"),
+            "propertyType": embed.get("propertyType")
+        })
+
+    for layout in section.get("roomTourLayoutInfos") or []:
+        for room in layout.get("roomTourItems") or []:
+            data["room_tour_items"].append(RoomTourItem(room.get("title"), room.get("imageIds", [])))
+
+def _extract_ratings(section, data):
+    # Tổng số review của listing, dùng để bỏ qua stage review khi không đổi
+    data["review_count"] = section.get("overallCount")
+    for rating in section.get("ratings") or []:
+        data["ratings"].append(Rating(
+            rating.get("categoryType"),
+            rating.get("localizedRating"),
+            rating.get("percentage")
+        ))
+
+def _extract_policies(section, data):
+    for group in section.get("houseRulesSections") or []:
+        for item in group.get("items") or []:
+            data["policies"]["house_rules"].append(item.get("title", ""))
+    for group in section.get("safetyAndPropertiesSections") or []:
+        for item in group.get("items") or []:
+            data["policies"]["safety_properties"].append(item.get("title", ""))
+    data["policies"]["house_rules_subtitle"] = section.get("houseRulesSubtitle", "")
+
+def _extract_highlights(section, data):
+    # Default highlights
+    for h in section.get("highlights") or []:
+        data["highlights"].append(Highlight(h.get("title"), h.get("subtitle"), h.get("icon")))
+
+def _extract_descriptions(section, data):
+    for item in section.get("items") or []:
+        data["descriptions"].append(Description(
+            item.get("title", ""),
+            item.get("html", {}).get("htmlText", "")
+        ))
+
+def _extract_amenities(section, data):
+    for group in section.get("seeAllAmenitiesGroups") or []:
+        data["amenities"].append(AmenityGroup(
+            group.get("title"),
+            [Amenity(a.get("available"), a.get("title"), a.get("icon")) for a in group.get("amenities", [])]
+        ))
+
+def _extract_location(section, data):
+    data["apartment_info"]["lat"] = section.get("lat")
+    data["apartment_info"]["lng"] = section.get("lng")
+    if section.get("previewLocationDetails"):
+        data["apartment_info"]["location_description"] = (
+            section["previewLocationDetails"][0].get("content", {}).get("htmlText", "")
+        )
+
+# __typename -> hàm xử lý; section có __typename khác bị bỏ qua
+SECTION_HANDLERS = {
+    "PhotoTourModalSection": _extract_photo_tour,
+    "StayPdpReviewsSection": _extract_ratings,
+    "PoliciesSection": _extract_policies,
+    "PdpHighlightsSection": _extract_highlights,
+    "GeneralListContentSection": _extract_descriptions,
+    "AmenitiesSection": _extract_amenities,
+    "LocationSection": _extract_location
+}
+
+# __typename -> các key trong data mà hàm xử lý section đó ghi vào
+SECTION_DATA_KEYS = {
+    "PhotoTourModalSection": ("images", "apartment_info", "room_tour_items"),
+    "StayPdpReviewsSection": ("ratings", "review_count"),
+    "PoliciesSection": ("policies",),
+    "PdpHighlightsSection": ("highlights",),
+    "GeneralListContentSection": ("descriptions",),
+    "AmenitiesSection": ("amenities",),
+    "LocationSection": ("apartment_info",)
+}
+
+def section_handlers(section_types):
+    # Bảng xử lý chỉ gồm các section cần lấy, section khác bị bỏ qua kể cả khi server vẫn trả về
+    return {section_type: SECTION_HANDLERS[section_type] for section_type in section_types}
+
+def requested_section_types(variables):
+    # Các section đã được yêu cầu qua sectionIds (variables là chuỗi JSON lưu trong raw store), None nếu lấy đầy đủ
+    section_ids = json.loads(variables or "{}").get("pdpSectionsRequest", {}).get("sectionIds")
+    if not section_ids:
+        return None
+    return [section_type for section_type, section_id in SECTION_IDS.items() if section_id in section_ids]
+
+def merge_listing_data(stored_data, refreshed_data, section_types):
+    """Ghép kết quả refresh một phần vào data đã lưu của listing.
+
+    section_types là các section extract_listing_data thực sự gặp trong response: section được
+    yêu cầu nhưng không có trong response thì giữ nguyên giá trị đã lưu. Chỉ các key thuộc các
+    section này bị thay (apartment_info được cập nhật từng field), giá chỉ bị thay khi stayCheckout
+    trả về giá; phần còn lại giữ nguyên như đã lưu.
+    """
+    merged = dict(stored_data)
+    for section_type in section_types:
+        for key in SECTION_DATA_KEYS[section_type]:
+            if key == "apartment_info":
+                merged[key] = {**merged.get(key, {}), **refreshed_data[key]}
+            else:
+                merged[key] = refreshed_data[key]
+    if refreshed_data["price"]["currency"]:
+        merged["price"] = refreshed_data["price"]
+    return merged
+
+def _extract_price(price, data):
+    # Duyệt các price item của stayCheckout đúng một lần
+    for item in price or []:
+        for nested in item.get("nestedPriceItems") or []:
+            total = nested.get("total", {})
+            data["price"]["currency"] = total.get("currency")
+            title = nested.get("localizedTitle", "")
+            if "đêm" in title or "night" in title:
+                micros = int(total.get("amountMicros", 0))
+                data["price"]["night_price"] = int(micros / 1_000_000)
+
+def extract_listing_data(info, price, listing_id, handlers=SECTION_HANDLERS):
+    # Trả về (record, tập __typename của các section đã xử lý)
     data = {
         "images": [],
         "apartment_info": {},
         "room_tour_items": [],
         "ratings": [],
+        "review_count": None,
         "policies": {
             "house_rules": [],
             "safety_properties": [],
@@ -141,121 +318,30 @@ def extract_listing_data(info, price, listing_id):
             "sharing_location": location_info
         })
 
-    # Lấy sections để xử lý như trước
-    sections = info.get("sections", [])
-    
-    for section_container in sections:
-        # Kiểm tra xem section_container có hợp lệ không
-        if not section_container or "section" not in section_container:
+    # Mỗi loại section cần lấy chỉ xuất hiện một lần trong response,
+    # nên dừng duyệt ngay khi đã gặp đủ tất cả các loại
+    remaining = set(handlers)
+    handled = set()
+    for section_container in info.get("sections", []):
+        # Kiểm tra xem section_container và section có hợp lệ không
+        section = section_container.get("section") if section_container else None
+        if not section:
             continue
 
-        # Trích xuất section từ container
-        section = section_container["section"] 
-
-        # Kiểm tra xem section có hợp lệ không
-        if not section or "__typename" not in section:
+        section_type = section.get("__typename")
+        handler = handlers.get(section_type)
+        if handler is None:
             continue
 
-        # Lấy type của section
-        section_type = section["__typename"] 
-
-        # Images
-        if section_type == "PhotoTourModalSection":
-            media_items = section.get("mediaItems") or []
-            for media in media_items:
-                if media and media.get("__typename") == "Image":
-                    data["images"].append({
-                        "id": media.get("id"),
-                        "orientation": media.get("orientation"),
-                        "accessibilityLabel": media.get("accessibilityLabel"),
-                        "baseUrl": media.get("baseUrl")
-                    })
-
-            embed = section.get("shareSave", {}).get("embedData", {})
-            if embed:
-                data["apartment_info"].update({
-                    "id": embed.get("id"),
-                    "name": embed.get("name"),
-                    "personCapacity": embed.get("personCapacity"),
-                    "pictureUrl": embed.get("pictureUrl"),
-                    "propertyType": embed.get("propertyType")
-                })
-
-            for layout in section.get("roomTourLayoutInfos") or []:
-                for room in layout.get("roomTourItems") or []:
-                    data["room_tour_items"].append({
-                        "title": room.get("title"),
-                        "imageIds": room.get("imageIds", [])
-                    })
-
-        # Ratings
-        elif section_type == "StayPdpReviewsSection":
-            for rating in section.get("ratings") or []:
-                data["ratings"].append({
-                    "categoryType": rating.get("categoryType"),
-                    "localizedRating": rating.get("localizedRating"),
-                    "percentage": rating.get("percentage")
-                })
-
-        # Policies
-        elif section_type == "PoliciesSection":
-            for group in section.get("houseRulesSections") or []:
-                for item in group.get("items") or []:
-                    data["policies"]["house_rules"].append(item.get("title", ""))
-            for group in section.get("safetyAndPropertiesSections") or []:
-                for item in group.get("items") or []:
-                    data["policies"]["safety_properties"].append(item.get("title", ""))
-            data["policies"]["house_rules_subtitle"] = section.get("houseRulesSubtitle", "")
-
-        # Default highlights
-        elif section_type == "PdpHighlightsSection":
-            for h in section.get("highlights") or []:
-                data["highlights"].append({
-                    "title": h.get("title"),
-                    "subtitle": h.get("subtitle"),
-                    "type": h.get("icon")
-                })
-
-        # Descriptions
-        elif section_type == "GeneralListContentSection":
-            for item in section.get("items") or []:
-                data["descriptions"].append({
-                    "title": item.get("title", ""),
-                    "htmlText": item.get("html", {}).get("htmlText", "")
-                })
-
-        # Amenities
-        elif section_type == "AmenitiesSection":
-            for group in section.get("seeAllAmenitiesGroups") or []:
-                data["amenities"].append({
-                    "group_title": group.get("title"),
-                    "amenities": [{
-                        "available": a.get("available"),
-                        "title": a.get("title"),
-                        "icon": a.get("icon")
-                    } for a in group.get("amenities", [])]
-                })
-
-        # Location
-        elif section_type == "LocationSection":
-            data["apartment_info"]["lat"] = section.get("lat")
-            data["apartment_info"]["lng"] = section.get("lng")
-            if section.get("previewLocationDetails"):
-                data["apartment_info"]["location_description"] = (
-                    section["previewLocationDetails"][0].get("content", {}).get("htmlText", "")
-                )
-        
-        # Price
-        for item in price or []:
-            for nested in item.get("nestedPriceItems") or []:
-                total = nested.get("total", {})
-                data["price"]["currency"] = total.get("currency")
-                title = nested.get("localizedTitle", "")
-                if "đêm" in title or "night" in title:
-                    micros = int(total.get("amountMicros", 0))
-                    data["price"]["night_price"] = int(micros / 1_000_000)
-      
+        handler(section, data)
+        handled.add(section_type)
+        remaining.discard(section_type)
+        if not remaining:
+            break
+
+    _extract_price(price, data)
+
     return {
         "listing_id": listing_id,
         "data": data
-    }
\ No newline at end of file
+    }, handled
@@ -1,21 +1,21 @@
-import json, requests
 from datetime import datetime, timedelta
-from .headers import build_headers
+from .config import REVIEW_MAX_PAGES, REVIEW_PAGE_SIZE
+from .http_client import get_default_client
+from .records import Review
 
-def fetch_reviews(listing_id, hash_val, encoded_id, domain):
+def _reviews_variables(encoded_id, offset, limit, sorting):
     checkin = (datetime.today() + timedelta(days=7)).strftime("%Y-%m-%d")
     checkout = (datetime.today() + timedelta(days=8)).strftime("%Y-%m-%d")
-    url = f"{domain}/api/v3/StaysPdpReviewsQuery/{hash_val}"
-    variables = {
+    return {
         "id": encoded_id,
         "pdpReviewsRequest": {
             "fieldSelector": "for_p3_translation_only",
             "forPreview": False,
-            "limit": 24,
-            "offset": "0",
+            "limit": limit,
+            "offset": str(offset),
             "showingTranslationButton": False,
-            "first": 24,
-            "sortingPreference": "BEST_QUALITY",
+            "first": limit,
+            "sortingPreference": sorting,
             "checkinDate": checkin,
             "checkoutDate": checkout,
             "numberOfAdults": "1",
@@ -24,17 +24,37 @@ def fetch_reviews(listing_id, hash_val, encoded_id, domain):
             "numberOfPets": "0"
         }
     }
-    extensions = {"persistedQuery": {"version": 1, "sha256Hash": hash_val}}
 
-    r = requests.get(url, headers=build_headers(listing_id, hash_val), params={
-                    "operationName": "StaysPdpReviewsQuery",
-                    "locale": "vi",
-                    "currency": "VND",
-                    "variables": json.dumps(variables),
-                    "extensions": json.dumps(extensions)
-    })
-    r.raise_for_status()
-    return r.json().get("data", {}).get("presentation", {}).get("stayProductDetailPage", {}).get("reviews", {}).get("reviews", [])
+# Duyệt reviews theo thứ tự mới nhất trước, mỗi lần yield một trang
+def iter_review_pages(listing_id, hash_val, encoded_id, domain, client=None, page_size=REVIEW_PAGE_SIZE, max_pages=REVIEW_MAX_PAGES):
+    client = client or get_default_client()
+    for page in range(max_pages):
+        variables = _reviews_variables(encoded_id, page * page_size, page_size, "MOST_RECENT")
+        payload = client.graphql("StaysPdpReviewsQuery", hash_val, listing_id, variables, domain)
+        reviews = parse_reviews_response(payload)
+        if reviews:
+            yield reviews
+        # Trang thiếu là trang cuối
+        if len(reviews) < page_size:
+            return
+    print(f"[WARNING] Reached {max_pages} review pages for listing {listing_id}, older reviews are not fetched")
+
+# Fetch reviews mới: dừng ngay khi gặp review đã lưu (externalId trong known_ids).
+# known_ids rỗng thì lấy toàn bộ lịch sử (tối đa max_pages trang)
+def fetch_new_reviews(listing_id, hash_val, encoded_id, domain, client=None, known_ids=None,
+                      page_size=REVIEW_PAGE_SIZE, max_pages=REVIEW_MAX_PAGES):
+    known_ids = known_ids or set()
+    new_reviews = []
+    for reviews in iter_review_pages(listing_id, hash_val, encoded_id, domain, client, page_size, max_pages):
+        for review in reviews:
+            if review.get("id") in known_ids:
+                return new_reviews
+            new_reviews.append(review)
+    return new_reviews
+
+# Lấy danh sách reviews từ response StaysPdpReviewsQuery
+def parse_reviews_response(payload):
+    return payload.get("data", {}).get("presentation", {}).get("stayProductDetailPage", {}).get("reviews", {}).get("reviews", [])
 
 
 # Extract reviews data
@@ -47,17 +67,15 @@ def extract_reviews_data(info, listing_id):
     totalCount = 0
     for item in info or []:
         reviewer = item.get("reviewer", {})
-        review = {
-            "externalId": item.get("id"),
-            "reviewer": {
-                "pictureUrl": reviewer.get("pictureUrl"),
-                "firstName": reviewer.get("firstName")
-            },
-            "language": item.get("language"),
-            "createdAt": item.get("createdAt"),
-            "rating": item.get("rating"),
-            "comments": item.get("comments")
-        }
+        review = Review(
+            item.get("id"),
+            reviewer.get("pictureUrl"),
+            reviewer.get("firstName"),
+            item.get("language"),
+            item.get("createdAt"),
+            item.get("rating"),
+            item.get("comments")
+        )
         data["reviews"].append(review)
         totalCount += 1
 
@@ -66,4 +84,23 @@ def extract_reviews_data(info, listing_id):
     return {
         "listing_id": listing_id,
         "data": data
-    }
\ No newline at end of file
+    }
+
+# Ghép record reviews chỉ chứa review mới (merge=append) vào record đã lưu, dùng làm merge cho SegmentStore.add_file.
+# Trả về record đầy đủ (review mới trước), hoặc None nếu không có review mới cho listing đã lưu
+def merge_review_records(stored, record):
+    if record.get("merge") != "append":
+        return record
+    new_reviews = record.get("data", {}).get("reviews", [])
+    if stored is not None and not new_reviews:
+        return None
+    stored_reviews = stored.get("data", {}).get("reviews", []) if stored else []
+    new_ids = set(review.get("externalId") for review in new_reviews)
+    reviews = new_reviews + [review for review in stored_reviews if review.get("externalId") not in new_ids]
+    return {
+        "listing_id": record["listing_id"],
+        "data": {
+            "reviews": reviews,
+            "total_reviews": len(reviews)
+        }
+    }
@@ -0,0 +1,280 @@
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from crawler.config import FRONTIER_MAX_ATTEMPTS, FRONTIER_REFETCH_AFTER
+
+CRAWLER_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_FRONTIER_FILE = os.path.join(CRAWLER_ROOT, "output", "frontier.sqlite3")
+
+# Trạng thái của một listing trong từng stage (listing_info, review, calendar)
+PENDING = "pending"
+FETCHED = "fetched"
+FAILED = "failed"
+DEAD = "dead"
+
+def legacy_listing_ids_file(province=None):
+    # File txt cũ do fetch_listing_ids ghi ra trước khi có frontier
+    if province is None:
+        return os.path.join(CRAWLER_ROOT, "output", "listing_ids.txt")
+    return os.path.join(CRAWLER_ROOT, "output", "listing_ids", f"listing_ids_{province}.txt")
+
+class Frontier:
+    """Danh sách listing ID và trạng thái crawl của từng listing theo từng stage, lưu trong SQLite.
+
+    - listings: listing_id (khoá chính, dedupe O(1)) -> province
+    - crawl_state: (listing_id, stage) -> state, last_fetch_time, attempts, last_error
+    - review_counts: listing_id -> số review thấy trên PDP gần nhất (observed)
+      và số review đó tại lần crawl reviews thành công gần nhất (crawled)
+    - review_history: listing đã được lấy toàn bộ lịch sử reviews theo thứ tự mới nhất
+    - calendar_stored: thời điểm fetch của calendar đã upsert thành công vào MongoDB gần nhất
+
+    Mỗi stage lấy việc bằng pending(): listing chưa crawl, lỗi nhưng chưa quá
+    `max_attempts` lần, hoặc đã crawl nhưng cũ hơn thời gian refetch của stage.
+    Lỗi không do listing (circuit mở, throttle, hash) không được tính vào số lần thử.
+    """
+
+    def __init__(self, path=DEFAULT_FRONTIER_FILE):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS listings (
+                listing_id TEXT PRIMARY KEY,
+                province TEXT,
+                discovered_at TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_listings_province ON listings (province);
+            CREATE TABLE IF NOT EXISTS crawl_state (
+                listing_id TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                state TEXT NOT NULL,
+                last_fetch_time TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                PRIMARY KEY (listing_id, stage)
+            );
+            CREATE INDEX IF NOT EXISTS idx_crawl_state_stage ON crawl_state (stage, state, last_fetch_time);
+            CREATE TABLE IF NOT EXISTS review_counts (
+                listing_id TEXT PRIMARY KEY,
+                observed INTEGER,
+                observed_at TEXT,
+                crawled INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS review_history (
+                listing_id TEXT PRIMARY KEY,
+                captured_at TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS calendar_stored (
+                listing_id TEXT PRIMARY KEY,
+                fetched_at TEXT NOT NULL
+            );
+        """)
+        self._conn.commit()
+
+    def add_listings(self, listing_ids, province=None):
+        # Thêm listing mới; listing đã có thì giữ nguyên, chỉ gán province nếu chưa có.
+        # Trả về số listing mới hoặc vừa được gán province
+        now = datetime.now().isoformat()
+        rows = [(str(lid).strip(), province, now) for lid in listing_ids
+                if lid is not None and lid != "None" and str(lid).strip() != ""]
+        with self._lock:
+            before = self._conn.total_changes
+            # Listing nhập trước đó không có province (vd. từ file listing_ids.txt chung) vẫn thuộc về province này
+            self._conn.executemany("""
+                INSERT INTO listings (listing_id, province, discovered_at) VALUES (?, ?, ?)
+                ON CONFLICT (listing_id) DO UPDATE SET province = COALESCE(listings.province, excluded.province)
+                WHERE listings.province IS NULL
+            """, rows)
+            self._conn.commit()
+            return self._conn.total_changes - before
+
+    def import_legacy_file(self, province=None):
+        # Chuyển file listing_ids txt cũ vào frontier, chỉ khi frontier chưa có listing nào của province đó
+        path = legacy_listing_ids_file(province)
+        if not os.path.exists(path) or self.count_listings(province):
+            return 0
+        with open(path, 'r', encoding='utf-8') as f:
+            added = self.add_listings((line.strip() for line in f), province)
+        print(f"[INFO] Imported {added} listing IDs from {path} into frontier")
+        return added
+
+    def count_listings(self, province=None):
+        with self._lock:
+            if province is None:
+                return self._conn.execute("SELECT COUNT(*) FROM listings").fetchone()[0]
+            return self._conn.execute("SELECT COUNT(*) FROM listings WHERE province = ?", [province]).fetchone()[0]
+
+    def pending(self, stage, province=None, max_attempts=FRONTIER_MAX_ATTEMPTS, refetch_after=None):
+        # Listing cần xử lý ở stage này, theo thứ tự phát hiện
+        if refetch_after is None:
+            refetch_after = FRONTIER_REFETCH_AFTER.get(stage)
+        stale_before = (datetime.now() - timedelta(seconds=refetch_after)).isoformat() if refetch_after else ""
+
+        query = """
+            SELECT l.listing_id FROM listings l
+            LEFT JOIN crawl_state s ON s.listing_id = l.listing_id AND s.stage = ?
+            WHERE (s.state IS NULL OR s.state = ?
+                   OR (s.state = ? AND s.attempts < ?)
+                   OR (s.state = ? AND s.last_fetch_time < ?))
+        """
+        params = [stage, PENDING, FAILED, max_attempts, FETCHED, stale_before]
+        if province is not None:
+            query += " AND l.province = ?"
+            params.append(province)
+        query += " ORDER BY l.discovered_at, l.listing_id"
+        with self._lock:
+            return [row[0] for row in self._conn.execute(query, params).fetchall()]
+
+    def pull(self, stage, province=None):
+        # Danh sách việc cho một lần chạy stage, chuyển file txt cũ vào frontier nếu cần
+        self.import_legacy_file(province)
+        listing_ids = self.pending(stage, province)
+        print(f"[INFO] {len(listing_ids)} listings need {stage} (states: {self.counts(stage, province)})")
+        return listing_ids
+
+    def mark_fetched(self, listing_id, stage):
+        with self._lock:
+            self._conn.execute("""
+                INSERT INTO crawl_state (listing_id, stage, state, last_fetch_time, attempts, last_error)
+                VALUES (?, ?, ?, ?, 0, NULL)
+                ON CONFLICT (listing_id, stage) DO UPDATE SET
+                    state = excluded.state, last_fetch_time = excluded.last_fetch_time, attempts = 0, last_error = NULL
+            """, [str(listing_id), stage, FETCHED, datetime.now().isoformat()])
+            self._conn.commit()
+
+    def mark_failed(self, listing_id, stage, error=None, max_attempts=FRONTIER_MAX_ATTEMPTS):
+        # Tăng số lần thử; quá max_attempts thì chuyển sang dead và không lấy lại nữa
+        with self._lock:
+            self._conn.execute("""
+                INSERT INTO crawl_state (listing_id, stage, state, last_fetch_time, attempts, last_error)
+                VALUES (?, ?, ?, ?, 1, ?)
+                ON CONFLICT (listing_id, stage) DO UPDATE SET
+                    attempts = crawl_state.attempts + 1,
+                    state = CASE WHEN crawl_state.attempts + 1 >= ? THEN ? ELSE ? END,
+                    last_fetch_time = excluded.last_fetch_time,
+                    last_error = excluded.last_error
+            """, [str(listing_id), stage, DEAD if max_attempts <= 1 else FAILED, datetime.now().isoformat(),
+                  None if error is None else str(error), max_attempts, DEAD, FAILED])
+            self._conn.commit()
+
+    def mark_deferred(self, listing_id, stage, error=None):
+        # Lỗi không do listing (outage, throttle, hash): listing quay lại pending, không tăng số lần thử
+        with self._lock:
+            self._conn.execute("""
+                INSERT INTO crawl_state (listing_id, stage, state, last_fetch_time, attempts, last_error)
+                VALUES (?, ?, ?, NULL, 0, ?)
+                ON CONFLICT (listing_id, stage) DO UPDATE SET state = excluded.state, last_error = excluded.last_error
+            """, [str(listing_id), stage, PENDING, None if error is None else str(error)])
+            self._conn.commit()
+
+    def record_result(self, listing_id, stage, error=None, transient=False):
+        if error is None:
+            self.mark_fetched(listing_id, stage)
+        elif transient:
+            self.mark_deferred(listing_id, stage, error)
+        else:
+            self.mark_failed(listing_id, stage, error)
+
+    # --- Số review theo PDP ---
+    def record_review_count(self, listing_id, count):
+        # Ghi số review đọc được từ StayPdpReviewsSection ở stage listing_info
+        with self._lock:
+            self._conn.execute("""
+                INSERT INTO review_counts (listing_id, observed, observed_at) VALUES (?, ?, ?)
+                ON CONFLICT (listing_id) DO UPDATE SET observed = excluded.observed, observed_at = excluded.observed_at
+            """, [str(listing_id), count, datetime.now().isoformat()])
+            self._conn.commit()
+
+    def mark_reviews_crawled(self, listing_id):
+        # Reviews đã được crawl xong ứng với số review đang thấy trên PDP
+        with self._lock:
+            self._conn.execute("UPDATE review_counts SET crawled = observed WHERE listing_id = ?", [str(listing_id)])
+            self._conn.commit()
+
+    def unchanged_review_counts(self, listing_ids):
+        # Các listing có số review trên PDP không đổi kể từ lần crawl reviews trước
+        listing_ids = [str(listing_id) for listing_id in listing_ids]
+        unchanged = set()
+        with self._lock:
+            for start in range(0, len(listing_ids), 500):
+                batch = listing_ids[start:start + 500]
+                rows = self._conn.execute(f"""
+                    SELECT listing_id FROM review_counts
+                    WHERE observed IS NOT NULL AND crawled = observed AND listing_id IN ({",".join("?" * len(batch))})
+                """, batch).fetchall()
+                unchanged.update(row[0] for row in rows)
+        return unchanged
+
+    # --- Lịch sử reviews ---
+    def mark_review_history_captured(self, listing_id):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO review_history (listing_id, captured_at) VALUES (?, ?)",
+                               [str(listing_id), datetime.now().isoformat()])
+            self._conn.commit()
+
+    def review_history_captured(self, listing_ids):
+        # Các listing đã có một lần lấy toàn bộ reviews; listing khác (vd. lưu bởi bản fetch một trang cũ)
+        # cần lấy toàn bộ trước khi được dừng ở review đã biết
+        listing_ids = [str(listing_id) for listing_id in listing_ids]
+        captured = set()
+        with self._lock:
+            for start in range(0, len(listing_ids), 500):
+                batch = listing_ids[start:start + 500]
+                rows = self._conn.execute(f"""
+                    SELECT listing_id FROM review_history WHERE listing_id IN ({",".join("?" * len(batch))})
+                """, batch).fetchall()
+                captured.update(row[0] for row in rows)
+        return captured
+
+    # --- Calendar đã lưu ---
+    def mark_calendar_stored(self, listing_id, fetched_at):
+        # Gọi sau khi upsert calendar vào MongoDB thành công; fetched_at là thời điểm fetch của calendar đó
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO calendar_stored (listing_id, fetched_at) VALUES (?, ?)",
+                               [str(listing_id), fetched_at])
+            self._conn.commit()
+
+    def clear_calendar_stored(self, listing_id):
+        # Upsert lỗi: không chắc calendar đã lưu còn đủ tháng, lần fetch sau lấy lại toàn bộ
+        with self._lock:
+            self._conn.execute("DELETE FROM calendar_stored WHERE listing_id = ?", [str(listing_id)])
+            self._conn.commit()
+
+    def calendar_stored_times(self, listing_ids):
+        # listing_id -> thời điểm fetch của calendar đã lưu gần nhất (listing chưa upsert thành công không có)
+        listing_ids = [str(listing_id) for listing_id in listing_ids]
+        times = {}
+        with self._lock:
+            for start in range(0, len(listing_ids), 500):
+                batch = listing_ids[start:start + 500]
+                rows = self._conn.execute(f"""
+                    SELECT listing_id, fetched_at FROM calendar_stored WHERE listing_id IN ({",".join("?" * len(batch))})
+                """, batch).fetchall()
+                times.update((listing_id, datetime.fromisoformat(fetched_at)) for listing_id, fetched_at in rows)
+        return times
+
+    def counts(self, stage, province=None):
+        # Số listing theo trạng thái ở stage này (listing chưa có state tính là pending)
+        query = """
+            SELECT COALESCE(s.state, ?), COUNT(*) FROM listings l
+            LEFT JOIN crawl_state s ON s.listing_id = l.listing_id AND s.stage = ?
+        """
+        params = [PENDING, stage]
+        if province is not None:
+            query += " WHERE l.province = ?"
+            params.append(province)
+        query += " GROUP BY 1"
+        with self._lock:
+            return dict(self._conn.execute(query, params).fetchall())
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
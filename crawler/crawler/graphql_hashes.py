@@ -1,9 +1,9 @@
+import asyncio
 import re
-from playwright.sync_api import sync_playwright
+from crawler.browser_pool import BrowserPool
 from crawler.config import API_DOMAIN
-from datetime import datetime, timedelta
 
-def extract_sha256_hashes(listing_id):
+async def extract_sha256_hashes_async(pool, listing_id):
     hashes = {
         "StaysPdpSections": None,
         "StaysPdpReviewsQuery": None,
@@ -25,20 +25,37 @@ def extract_sha256_hashes(listing_id):
             except Exception as e:
                 print(f"[ERROR] While extracting hash: {e}\n")
 
-    with sync_playwright() as p:
-        browser = p.chromium.launch(headless=True)
-        context = browser.new_context()
-        page = context.new_page()
+    async with pool.page() as page:
         page.on("request", on_request)
-        page.goto(f"{API_DOMAIN}/rooms/{listing_id}")
+        await page.goto(f"{API_DOMAIN}/rooms/{listing_id}")
         try:
-            page.get_by_role("button", name="Đóng").click()
+            await page.get_by_role("button", name="Đóng").click()
         except:
             pass
-        context.close()
-        browser.close()
 
     for key, value in hashes.items():
         print(f"[HASH] {key}: {value if value else 'Not found'}")
 
-    return hashes
\ No newline at end of file
+    return hashes
+
+async def _discover_hashes_async(listing_ids, required):
+    # Dùng một browser cho tất cả listing cần thử
+    async with BrowserPool(headless=True) as pool:
+        for listing_id in listing_ids:
+            try:
+                hashes = await extract_sha256_hashes_async(pool, listing_id)
+                if all(hashes.get(operation) for operation in required):
+                    return hashes
+                else:
+                    print(f"[WARNING] Not enough hashes from listing_id: {listing_id}")
+            except Exception as e:
+                print(f"[ERROR] Error getting hash from listing_id {listing_id}: {e}")
+                continue
+    return None
+
+def discover_hashes(listing_ids, required):
+    # Lấy hash bằng Playwright từ listing_id đầu tiên có thể, nếu lỗi thì thử tiếp
+    hashes = asyncio.run(_discover_hashes_async(listing_ids, required))
+    if not hashes:
+        print("[ERROR] Could not get hash from any listing_id!")
+    return hashes
@@ -0,0 +1,167 @@
+import json
+import os
+import threading
+from datetime import datetime
+from crawler.config import API_DOMAIN, HASH_CACHE_TTL
+from crawler.fetch_listing_info import SECTION_IDS
+from crawler.headers import encode_listing_id
+from crawler.http_client import PersistedQueryNotFoundError, get_default_client, is_persisted_query_not_found
+
+CRAWLER_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_HASH_CACHE_FILE = os.path.join(CRAWLER_ROOT, "output", "graphql_hashes.json")
+
+def load_cached_hashes(path=DEFAULT_HASH_CACHE_FILE):
+    # Trả về (hashes, updated_at) hoặc (None, None) nếu chưa có cache
+    if not os.path.exists(path):
+        return None, None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            content = json.load(f)
+        return content.get("hashes") or {}, datetime.fromisoformat(content["updated_at"])
+    except (json.JSONDecodeError, KeyError, ValueError, OSError) as e:
+        print(f"[WARNING] Could not read hash cache {path}: {e}")
+        return None, None
+
+def save_cached_hashes(hashes, path=DEFAULT_HASH_CACHE_FILE):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({"hashes": hashes, "updated_at": datetime.now().isoformat()}, f, indent=2)
+    os.replace(tmp_path, path)
+
+# Variables nhỏ nhất cho mỗi operation, chỉ để kiểm tra hash còn hợp lệ
+def _probe_variables(operation, listing_id):
+    encoded_id = encode_listing_id(listing_id)
+    today = datetime.today()
+    if operation == "PdpAvailabilityCalendar":
+        return {"request": {"count": 1, "listingId": listing_id, "month": today.month, "year": today.year}}
+    if operation == "StaysPdpReviewsQuery":
+        return {"id": encoded_id, "pdpReviewsRequest": {
+            "fieldSelector": "for_p3_translation_only", "forPreview": False, "limit": 1, "offset": "0",
+            "showingTranslationButton": False, "first": 1, "sortingPreference": "BEST_QUALITY",
+            "numberOfAdults": "1", "numberOfChildren": "0", "numberOfInfants": "0", "numberOfPets": "0"
+        }}
+    if operation == "StaysPdpSections":
+        # Chỉ yêu cầu một section nhỏ thay vì toàn bộ trang
+        return {"id": encoded_id, "wishlistTenantIntegrationEnabled": True, "pdpSectionsRequest": {
+            "adults": "1", "layouts": ["SIDEBAR", "SINGLE_COLUMN"], "pets": 0, "preview": False,
+            "bypassTargetings": False, "staysBookingMigrationEnabled": False,
+            "useNewSectionWrapperApi": False, "p3ImpressionId": "p3_dummy",
+            "sectionIds": [SECTION_IDS["PdpHighlightsSection"]]
+        }}
+    return None
+
+def probe_hash(operation, hash_val, listing_id, client=None):
+    # Gửi một request nhỏ để kiểm tra hash của operation còn được server chấp nhận không
+    variables = _probe_variables(operation, listing_id)
+    if variables is None:
+        # Không có cách probe rẻ (vd. stayCheckout dùng hash cố định), coi như hợp lệ
+        return True
+
+    client = client or get_default_client()
+    try:
+        payload = client.graphql(operation, hash_val, listing_id, variables, API_DOMAIN)
+    except Exception as e:
+        print(f"[WARNING] Probe for {operation} failed: {e}")
+        return False
+
+    if is_persisted_query_not_found(payload) or payload.get("data") is None:
+        print(f"[WARNING] Cached hash for {operation} is no longer valid")
+        return False
+    return True
+
+def discover_hashes(listing_ids, required):
+    # Playwright chỉ được import khi thực sự cần lấy lại hash
+    from crawler.graphql_hashes import discover_hashes as discover_with_browser
+    return discover_with_browser(listing_ids, required)
+
+def get_valid_hashes(listing_ids, required, client=None, ttl=HASH_CACHE_TTL, path=DEFAULT_HASH_CACHE_FILE):
+    """Lấy GraphQL hash cho các operation trong `required`.
+
+    Dùng cache trên đĩa nếu còn trong TTL và một probe tới operation đầu tiên
+    của `required` thành công; chỉ mở Playwright khi cache hết hạn hoặc probe lỗi.
+    """
+    cached, updated_at = load_cached_hashes(path)
+    if cached and all(cached.get(operation) for operation in required):
+        age = (datetime.now() - updated_at).total_seconds()
+        if age > ttl:
+            print(f"[INFO] Hash cache expired ({int(age)}s old), re-extracting...")
+        elif listing_ids and probe_hash(required[0], cached[required[0]], listing_ids[0], client):
+            print(f"[INFO] Using cached hashes ({int(age)}s old)")
+            return cached
+
+    hashes = discover_hashes(listing_ids, required)
+    if not hashes:
+        return None
+
+    # Giữ lại hash cũ của các operation không bắt được trong lần này
+    merged = dict(cached or {})
+    merged.update({operation: value for operation, value in hashes.items() if value})
+    save_cached_hashes(merged, path)
+    return merged
+
+class HashRegistry:
+    """Hash hiện hành của từng operation, dùng chung cho mọi worker trong một lần chạy.
+
+    Khi một worker gặp PersistedQueryNotFound, nó gọi refresh(): chỉ một worker
+    chạy lại discovery bằng Playwright, các worker khác gọi current() cho cùng
+    operation sẽ chờ đến khi có hash mới rồi tiếp tục. Nếu discovery không lấy được
+    hash mới, current() cho operation đó raise PersistedQueryNotFoundError ngay,
+    không gửi thêm request chắc chắn lỗi với hash cũ.
+    """
+
+    def __init__(self, hashes, listing_ids, path=DEFAULT_HASH_CACHE_FILE):
+        self._hashes = dict(hashes)
+        self._listing_ids = list(listing_ids)
+        self._path = path
+        self._refreshing = set()
+        self._attempted = set()
+        # operation -> hash cũ mà discovery không thay được
+        self._failed = {}
+        self._cond = threading.Condition()
+
+    def current(self, operation, fallback=None):
+        # Chờ nếu operation đang được refresh, sau đó trả về hash mới nhất
+        with self._cond:
+            while operation in self._refreshing:
+                self._cond.wait()
+            hash_val = self._hashes.get(operation) or fallback
+            if hash_val is not None and self._failed.get(operation) == hash_val:
+                raise PersistedQueryNotFoundError(operation, hash_val)
+            return hash_val
+
+    def refresh(self, operation, stale_hash):
+        # Trả về hash mới, hoặc None nếu không lấy được hash khác với stale_hash
+        with self._cond:
+            while operation in self._refreshing:
+                self._cond.wait()
+            current = self._hashes.get(operation)
+            if current and current != stale_hash:
+                # Worker khác đã refresh xong
+                return current
+            if (operation, stale_hash) in self._attempted:
+                # Đã thử discovery cho hash này rồi, không chạy lại
+                return None
+            self._attempted.add((operation, stale_hash))
+            self._refreshing.add(operation)
+
+        new_hashes = None
+        try:
+            print(f"[WARNING] Hash for {operation} was rotated, pausing {operation} and re-discovering...")
+            new_hashes = discover_hashes(self._listing_ids, (operation,))
+        finally:
+            with self._cond:
+                if new_hashes:
+                    self._hashes.update({op: value for op, value in new_hashes.items() if value})
+                    save_cached_hashes(self._hashes, self._path)
+                self._refreshing.discard(operation)
+                self._cond.notify_all()
+
+        new_hash = self._hashes.get(operation)
+        if not new_hash or new_hash == stale_hash:
+            print(f"[ERROR] Could not get a new hash for {operation}, failing later {operation} requests without sending them")
+            with self._cond:
+                self._failed[operation] = stale_hash
+            return None
+        print(f"[INFO] Resuming {operation} with new hash {new_hash}")
+        return new_hash
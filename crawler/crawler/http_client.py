@@ -0,0 +1,178 @@
+import json
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from crawler.config import API_DOMAIN, POOL_MAXSIZE, REQUEST_TIMEOUT
+from crawler.headers import build_headers
+from crawler.rate_limiter import RateLimiterRegistry, is_throttle_status
+from crawler.retry import CircuitOpenError, RetryPolicy, RetryBudget, CircuitBreakerRegistry, is_retryable_error, is_breaker_failure
+
+class PersistedQueryNotFoundError(Exception):
+    # Server không còn nhận hash của operation (hash đã bị đổi)
+    def __init__(self, operation, hash_val):
+        super().__init__(f"PersistedQueryNotFound for {operation} ({hash_val})")
+        self.operation = operation
+        self.hash_val = hash_val
+
+class CrawlerClient:
+    """HTTP client dùng chung cho tất cả fetcher.
+
+    Giữ một requests.Session với connection pool keep-alive tới API_DOMAIN,
+    nên các request liên tiếp không phải bắt tay TCP+TLS lại từ đầu.
+    """
+
+    def __init__(self, domain=API_DOMAIN, pool_maxsize=POOL_MAXSIZE, timeout=REQUEST_TIMEOUT, rate_limiters=None,
+                 retry_policy=None, retry_budget=None, circuit_breakers=None, raw_store=None, hash_registry=None):
+        self.domain = domain
+        self.timeout = timeout
+        self.rate_limiters = rate_limiters or RateLimiterRegistry()
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.retry_budget = retry_budget or RetryBudget()
+        self.circuit_breakers = circuit_breakers or CircuitBreakerRegistry()
+        # Nếu có raw_store, mọi response thành công được lưu nguyên bản để xử lý lại offline
+        self.raw_store = raw_store
+        # Nếu có hash_registry, hash mới nhất của operation luôn được dùng thay cho hash caller truyền vào
+        self.hash_registry = hash_registry
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Accept-Encoding": "gzip, deflate",
+            "Connection": "keep-alive"
+        })
+
+    def graphql(self, operation, hash_val, listing_id, variables, domain=None):
+        # Gọi một persisted query GraphQL và trả về toàn bộ JSON response.
+        # Hash bị đổi giữa chừng được refresh một lần qua hash_registry rồi gửi lại.
+        if self.hash_registry is not None:
+            hash_val = self.hash_registry.current(operation, hash_val)
+
+        while True:
+            try:
+                return self._call_with_retries(
+                    operation, listing_id,
+                    lambda: self._send(operation, hash_val, listing_id, variables, domain)
+                )
+            except PersistedQueryNotFoundError:
+                new_hash = self.hash_registry.refresh(operation, hash_val) if self.hash_registry is not None else None
+                if not new_hash:
+                    raise
+                hash_val = new_hash
+
+    def post_json(self, operation, url, body, headers=None, listing_id=None):
+        # Gửi POST JSON (vd. StaysSearch) qua cùng rate limiter, retry và circuit breaker
+        return self._call_with_retries(operation, listing_id, lambda: self._post(operation, url, body, headers))
+
+    def _call_with_retries(self, operation, listing_id, send):
+        # Lỗi tạm thời được thử lại với backoff, trong giới hạn của retry budget
+        # và circuit breaker của operation đó
+        breaker = self.circuit_breakers.get(operation)
+        self.retry_budget.deposit()
+
+        attempt = 0
+        while True:
+            breaker.before_request()
+            try:
+                payload = send()
+            except Exception as e:
+                if is_breaker_failure(e):
+                    breaker.record_failure()
+                else:
+                    breaker.release()
+                if (not is_retryable_error(e)
+                        or attempt + 1 >= self.retry_policy.max_attempts
+                        or not self.retry_budget.try_withdraw()):
+                    raise
+                delay = self.retry_policy.backoff(attempt, e)
+                attempt += 1
+                print(f"[RETRY] {operation} for listing {listing_id} (attempt {attempt + 1}) in {delay:.1f}s: {e}")
+                time.sleep(delay)
+                continue
+            breaker.record_success()
+            return payload
+
+    def _record_status(self, limiter, r):
+        if is_throttle_status(r.status_code):
+            limiter.on_throttle()
+        elif r.ok:
+            limiter.on_success()
+
+    def _post(self, operation, url, body, headers):
+        limiter = self.rate_limiters.get(operation)
+        limiter.acquire()
+        r = self.session.post(url, json=body, headers=headers, timeout=self.timeout)
+        self._record_status(limiter, r)
+        r.raise_for_status()
+        return r.json()
+
+    def _send(self, operation, hash_val, listing_id, variables, domain=None):
+        url = f"{domain or self.domain}/api/v3/{operation}/{hash_val}"
+        extensions = {"persistedQuery": {"version": 1, "sha256Hash": hash_val}}
+        params = {
+            "operationName": operation,
+            "locale": "vi",
+            "currency": "VND",
+            "variables": json.dumps(variables),
+            "extensions": json.dumps(extensions)
+        }
+
+        limiter = self.rate_limiters.get(operation)
+        limiter.acquire()
+        r = self.session.get(url, headers=build_headers(listing_id, hash_val), timeout=self.timeout, params=params)
+        self._record_status(limiter, r)
+
+        # Lỗi hash có thể đi kèm status 200 hoặc 4xx
+        try:
+            payload = r.json()
+        except ValueError:
+            payload = None
+        if is_persisted_query_not_found(payload):
+            raise PersistedQueryNotFoundError(operation, hash_val)
+
+        r.raise_for_status()
+        if payload is None:
+            payload = r.json()
+        if self.raw_store is not None:
+            self.raw_store.put(listing_id, operation, r.content, params["variables"])
+        return payload
+
+    def rates(self):
+        # Rate hiện tại của từng operation, dùng để theo dõi throughput bền vững
+        return self.rate_limiters.rates()
+
+    def close(self):
+        self.session.close()
+        if self.raw_store is not None:
+            self.raw_store.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def is_persisted_query_not_found(payload):
+    # Airbnb trả về lỗi PersistedQueryNotFound khi hash của operation đã bị đổi
+    if not isinstance(payload, dict):
+        return False
+    for error in payload.get("errors") or []:
+        code = (error.get("extensions") or {}).get("code", "")
+        text = f"{error.get('message', '')} {code}"
+        if "PersistedQueryNotFound" in text or "PERSISTED_QUERY_NOT_FOUND" in text:
+            return True
+    return False
+
+def is_transient_failure(error):
+    # Lỗi không do listing: circuit đang mở, bị throttle/5xx/403 sau khi hết retry, hash không dùng được.
+    # Frontier không tính các lỗi này vào số lần thử của listing
+    return isinstance(error, (CircuitOpenError, PersistedQueryNotFoundError)) or is_breaker_failure(error)
+
+_default_client = None
+
+def get_default_client():
+    # Client dùng chung khi caller không truyền client riêng
+    global _default_client
+    if _default_client is None:
+        _default_client = CrawlerClient()
+    return _default_client
@@ -0,0 +1,160 @@
+import json
+import os
+from crawler.records import record_to_json
+
+class JsonlWriter:
+    """Ghi record ra file JSON Lines: mỗi record một dòng JSON compact, chỉ append.
+
+    Ghi một record không cần đọc lại file, nên chi phí không phụ thuộc số record
+    đã có. Record trùng listing_id được giữ nguyên, compact_jsonl() gộp lại sau.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        _truncate_partial_line(filename)
+        self._file = open(filename, 'a', encoding='utf-8')
+
+    def write(self, record):
+        # Record kiểu __slots__ (crawler.records) được chuyển sang dict tại đây
+        self._file.write(json.dumps(record, ensure_ascii=False, separators=(",", ":"), default=record_to_json) + "\n")
+
+    def flush(self):
+        # Đẩy dữ liệu xuống đĩa, gọi ở mỗi checkpoint
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def _truncate_partial_line(filename):
+    # Bỏ dòng cuối bị ghi dở (vd. process bị kill giữa chừng) để dòng append tiếp theo không bị dính vào
+    if not os.path.exists(filename) or os.path.getsize(filename) == 0:
+        return
+    with open(filename, 'rb+') as f:
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) == b"\n":
+            return
+        size = f.seek(0, os.SEEK_END)
+        position = size
+        while position > 0:
+            step = min(65536, position)
+            f.seek(position - step)
+            chunk = f.read(step)
+            index = chunk.rfind(b"\n")
+            if index != -1:
+                f.truncate(position - step + index + 1)
+                break
+            position -= step
+        else:
+            f.truncate(0)
+    print(f"[WARNING] Dropped a partially written record at the end of {filename}")
+
+def iter_json_array(f, chunk_size=1 << 16):
+    """Đọc từng phần tử của một JSON array từ file đang mở, không tải cả file vào bộ nhớ.
+
+    Đọc file theo chunk và dùng JSONDecoder.raw_decode để tách lần lượt từng phần tử;
+    bộ nhớ chỉ cần đủ cho chunk hiện tại và phần tử đang đọc.
+    """
+    decoder = json.JSONDecoder()
+    buffer = f.read(chunk_size).lstrip()
+    if not buffer.startswith("["):
+        raise ValueError("Expected a JSON array")
+    buffer = buffer[1:]
+    eof = False
+
+    while True:
+        # Bỏ khoảng trắng và dấu phẩy giữa các phần tử
+        buffer = buffer.lstrip().lstrip(",").lstrip()
+        while not buffer and not eof:
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buffer = chunk.lstrip().lstrip(",").lstrip()
+        if buffer.startswith("]"):
+            return
+        if not buffer:
+            raise ValueError("Unexpected end of JSON array")
+
+        try:
+            item, end = decoder.raw_decode(buffer)
+            # Số hoặc literal nằm sát cuối buffer có thể còn tiếp ở chunk sau
+            complete = end < len(buffer) or eof
+            # Chunk cắt ngay sau "." hoặc "e" của số (vd. "-35." + "0]"): raw_decode trả về phần đã đọc
+            # như một số hoàn chỉnh, phần còn lại nằm ở chunk sau
+            if (complete and not eof and isinstance(item, (int, float)) and not isinstance(item, bool)
+                    and buffer[end] in ".eE+-"):
+                complete = False
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            complete = False
+        if not complete:
+            # Phần tử chưa đọc hết, đọc thêm (gấp đôi buffer để phần tử lớn không bị parse lại quá nhiều lần)
+            chunk = f.read(max(chunk_size, len(buffer)))
+            eof = not chunk
+            buffer += chunk
+            continue
+        yield item
+        buffer = buffer[end:]
+
+def iter_records(filename):
+    """Đọc lần lượt từng record của file output, không tải cả file vào bộ nhớ.
+
+    Hỗ trợ file JSON Lines, file JSON array cũ (định dạng trước khi có JsonlWriter)
+    và thư mục SegmentStore (trả về record mới nhất của mỗi listing).
+    """
+    if os.path.isdir(filename):
+        from crawler.segment_store import SegmentStore
+        root, kind = os.path.split(os.path.normpath(filename))
+        yield from SegmentStore(kind, root).iter_latest()
+        return
+
+    with open(filename, 'r', encoding='utf-8') as f:
+        first = f.read(1)
+        while first and first.isspace():
+            first = f.read(1)
+        if first == "[":
+            # File JSON array cũ
+            f.seek(0)
+            yield from iter_json_array(f)
+            return
+
+        f.seek(0)
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"[WARNING] Skipping invalid line {line_number} in {filename}: {e}")
+
+def compact_jsonl(filename, key="listing_id"):
+    """Gộp các record trùng key trong file JSON Lines, record ghi sau cùng được giữ lại.
+
+    Chỉ giữ trong bộ nhớ vị trí dòng cuối cùng của mỗi key; file mới được ghi
+    ra file tạm rồi đổi tên. Trả về (số record trước, số record sau).
+    """
+    last_line = {}
+    total = 0
+    for line_number, record in enumerate(iter_records(filename)):
+        total += 1
+        last_line[record.get(key) if isinstance(record, dict) else None] = line_number
+
+    keep = set(last_line.values())
+    tmp_filename = f"{filename}.tmp"
+    with open(tmp_filename, 'w', encoding='utf-8') as out:
+        for line_number, record in enumerate(iter_records(filename)):
+            if line_number in keep:
+                out.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+    os.replace(tmp_filename, filename)
+
+    print(f"[INFO] Compacted {filename}: {total} -> {len(keep)} records")
+    return total, len(keep)
@@ -0,0 +1,123 @@
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+
+# Các khoảng (checkin, checkout) tính theo số ngày kể từ hôm nay, theo thứ tự thử mặc định
+DEFAULT_DATE_RANGES = [
+    (7, 8),
+    (10, 11),
+    (14, 15),
+    (20, 21),
+    (30, 31),
+    (45, 46),
+    (60, 61),
+    (90, 91),
+    (120, 121),
+    (150, 151),
+    (180, 181)
+]
+
+CRAWLER_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_STATS_FILE = os.path.join(CRAWLER_ROOT, "output", "price_probe_stats.json")
+
+def _key(date_range):
+    return f"{date_range[0]}-{date_range[1]}"
+
+class ProbeStats:
+    """Thống kê khoảng ngày nào thường trả về giá, lưu giữa các lần chạy.
+
+    - scopes: {scope (vd. province): {"7-8": [số lần thành công, số lần thử]}}
+    - listings: {listing_id: [checkin_days, checkout_days]} khoảng thành công gần nhất
+    """
+
+    def __init__(self, path=DEFAULT_STATS_FILE, scopes=None, listings=None):
+        self.path = path
+        self.scopes = scopes or {}
+        self.listings = listings or {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path=DEFAULT_STATS_FILE):
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    content = json.load(f)
+                return cls(path, content.get("scopes", {}), content.get("listings", {}))
+            except (json.JSONDecodeError, OSError) as e:
+                print(f"[WARNING] Could not read price probe stats {path}: {e}")
+        return cls(path)
+
+    def save(self):
+        # Ghi ra file tạm rồi đổi tên để không làm hỏng file khi bị ngắt giữa chừng
+        with self._lock:
+            content = {"scopes": self.scopes, "listings": self.listings}
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(content, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+
+    def order(self, listing_id, scope=None, date_ranges=DEFAULT_DATE_RANGES):
+        # Sắp xếp khoảng ngày theo tỉ lệ thành công (làm mịn Laplace) trong scope,
+        # khoảng đã thành công gần nhất của chính listing được thử đầu tiên
+        with self._lock:
+            counts = self.scopes.get(scope, {}) if scope else {}
+            last_success = self.listings.get(str(listing_id))
+
+            def score(item):
+                index, date_range = item
+                success, attempts = counts.get(_key(date_range), (0, 0))
+                return (-(success + 1) / (attempts + 2), index)
+
+            ordered = [r for _, r in sorted(enumerate(date_ranges), key=score)]
+            if last_success and tuple(last_success) in ordered:
+                ordered.remove(tuple(last_success))
+                ordered.insert(0, tuple(last_success))
+            return ordered
+
+    def record(self, listing_id, scope, date_range, success):
+        with self._lock:
+            if scope:
+                counts = self.scopes.setdefault(scope, {})
+                entry = counts.setdefault(_key(date_range), [0, 0])
+                entry[1] += 1
+                if success:
+                    entry[0] += 1
+            if success:
+                self.listings[str(listing_id)] = list(date_range)
+
+def pick_stay_dates(calendar_months, max_candidates=3, today=None):
+    """Chọn các cặp (checkin, checkout) chắc chắn đặt được từ calendar của listing.
+
+    Ngày checkin phải availableForCheckin và bookable, độ dài ở bằng minNights,
+    các đêm ở giữa còn trống và ngày checkout cho phép checkout.
+    """
+    today = today or datetime.today().strftime("%Y-%m-%d")
+    days = {}
+    for month in calendar_months or []:
+        for day in month.get("days") or []:
+            if day.get("calendarDate"):
+                days[day["calendarDate"]] = day
+
+    candidates = []
+    for date_str in sorted(days):
+        if date_str <= today:
+            continue
+        day = days[date_str]
+        if not day.get("availableForCheckin") or day.get("bookable") is False:
+            continue
+
+        nights = max(1, day.get("minNights") or 1)
+        checkin = datetime.strptime(date_str, "%Y-%m-%d")
+        stay = [(checkin + timedelta(days=n)).strftime("%Y-%m-%d") for n in range(nights + 1)]
+        checkout = stay[-1]
+        if any(not days.get(night, {}).get("available") for night in stay[:-1]):
+            continue
+        if checkout in days and days[checkout].get("availableForCheckout") is False:
+            continue
+
+        candidates.append((date_str, checkout))
+        if len(candidates) >= max_candidates:
+            break
+    return candidates
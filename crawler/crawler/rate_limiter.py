@@ -0,0 +1,90 @@
+import threading
+import time
+from crawler.config import (
+    RATE_LIMIT_INITIAL, RATE_LIMIT_MIN, RATE_LIMIT_MAX,
+    RATE_LIMIT_INCREASE, RATE_LIMIT_DECREASE, RATE_LIMIT_COOLDOWN
+)
+
+# Status code cho thấy server đang chặn/quá tải -> cần giảm tốc
+THROTTLE_STATUS_CODES = {403, 429}
+
+def is_throttle_status(status_code):
+    return status_code in THROTTLE_STATUS_CODES or status_code >= 500
+
+class AdaptiveRateLimiter:
+    """Token bucket có tốc độ điều chỉnh theo AIMD.
+
+    Mỗi response thành công tăng rate thêm khoảng `increase` request/giây
+    sau mỗi giây chạy ổn định (additive increase). Mỗi lần bị 429/403/5xx
+    thì rate nhân với `decrease` (multiplicative decrease), tối đa một lần
+    mỗi `cooldown` giây để các request đang bay không kéo rate xuống liên tục.
+    """
+
+    def __init__(self, name, rate=RATE_LIMIT_INITIAL, min_rate=RATE_LIMIT_MIN, max_rate=RATE_LIMIT_MAX,
+                 increase=RATE_LIMIT_INCREASE, decrease=RATE_LIMIT_DECREASE, cooldown=RATE_LIMIT_COOLDOWN):
+        self.name = name
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self._rate = rate
+        self._tokens = 1.0
+        self._last_refill = time.monotonic()
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def current_rate(self):
+        return self._rate
+
+    def _refill(self, now):
+        # Bucket chứa tối đa 1 giây token để burst không vượt quá rate hiện tại
+        capacity = max(1.0, self._rate)
+        self._tokens = min(capacity, self._tokens + (now - self._last_refill) * self._rate)
+        self._last_refill = now
+
+    def acquire(self):
+        # Chờ đến khi có token rồi lấy 1 token
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                wait = (1.0 - self._tokens) / self._rate
+            time.sleep(wait)
+
+    def on_success(self):
+        with self._lock:
+            self._rate = min(self.max_rate, self._rate + self.increase / max(self._rate, 1.0))
+
+    def on_throttle(self):
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_decrease < self.cooldown:
+                return
+            self._last_decrease = now
+            self._rate = max(self.min_rate, self._rate * self.decrease)
+            print(f"[WARNING] Throttled on {self.name}, rate lowered to {self._rate:.2f} req/s")
+
+class RateLimiterRegistry:
+    # Mỗi GraphQL operation có một limiter riêng
+    def __init__(self, **limiter_kwargs):
+        self._limiter_kwargs = limiter_kwargs
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def get(self, operation):
+        with self._lock:
+            limiter = self._limiters.get(operation)
+            if limiter is None:
+                limiter = AdaptiveRateLimiter(operation, **self._limiter_kwargs)
+                self._limiters[operation] = limiter
+            return limiter
+
+    def rates(self):
+        # Snapshot rate hiện tại (request/giây) của từng operation
+        with self._lock:
+            return {name: round(limiter.current_rate, 2) for name, limiter in self._limiters.items()}
@@ -0,0 +1,93 @@
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+CRAWLER_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_RAW_STORE_DIR = os.path.join(CRAWLER_ROOT, "output", "raw_payloads")
+
+class RawPayloadStore:
+    """Lưu nguyên body response GraphQL theo sha256 (content-addressed).
+
+    - objects/<2 ký tự đầu>/<sha256>.json.gz: body đã nén gzip, mỗi nội dung chỉ lưu một lần
+    - index.sqlite3: bảng payloads (listing_id, operation, fetch_time) -> sha256
+    """
+
+    def __init__(self, root=DEFAULT_RAW_STORE_DIR):
+        self.root = root
+        self.objects_dir = os.path.join(root, "objects")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(root, "index.sqlite3"), check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS payloads (
+                listing_id TEXT NOT NULL,
+                operation TEXT NOT NULL,
+                fetch_time TEXT NOT NULL,
+                sha256 TEXT NOT NULL,
+                variables TEXT,
+                PRIMARY KEY (listing_id, operation, fetch_time, sha256)
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_payloads_operation ON payloads (operation, listing_id, fetch_time)")
+        self._conn.commit()
+
+    def _object_path(self, sha256):
+        return os.path.join(self.objects_dir, sha256[:2], f"{sha256}.json.gz")
+
+    def put(self, listing_id, operation, body, variables=None, fetch_time=None):
+        # Lưu body (bytes) và ghi index, trả về sha256 của body
+        sha256 = hashlib.sha256(body).hexdigest()
+        path = self._object_path(sha256)
+
+        # Nội dung đã có thì không ghi lại (dedupe tự động)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with gzip.open(tmp_path, 'wb') as f:
+                f.write(body)
+            os.replace(tmp_path, path)
+
+        fetch_time = fetch_time or datetime.now().isoformat()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO payloads (listing_id, operation, fetch_time, sha256, variables) VALUES (?, ?, ?, ?, ?)",
+                [str(listing_id), operation, fetch_time, sha256, variables]
+            )
+            self._conn.commit()
+        return sha256
+
+    def get(self, sha256):
+        with gzip.open(self._object_path(sha256), 'rb') as f:
+            return f.read()
+
+    def get_json(self, sha256):
+        return json.loads(self.get(sha256))
+
+    def history(self, listing_id, operation):
+        # Tất cả lần fetch của một listing cho một operation, mới nhất trước
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT fetch_time, sha256, variables FROM payloads WHERE listing_id = ? AND operation = ? ORDER BY fetch_time DESC",
+                [str(listing_id), operation]
+            ).fetchall()
+        return rows
+
+    def latest(self, listing_id, operation):
+        rows = self.history(listing_id, operation)
+        return rows[0] if rows else None
+
+    def listing_ids(self, operation):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT listing_id FROM payloads WHERE operation = ? ORDER BY listing_id",
+                [operation]
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
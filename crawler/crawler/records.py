@@ -0,0 +1,81 @@
+"""Kiểu record gọn (dùng __slots__) cho các phần tử lặp nhiều trong dữ liệu crawl.
+
+Mỗi ảnh, tiện nghi, review, ngày trong calendar... là một object __slots__ thay vì
+một dict riêng, nên tốn ít bộ nhớ và ít cấp phát hơn trong vòng lặp extract.
+Chỉ chuyển sang dict khi ghi ra JSON: json.dumps(..., default=record_to_json).
+Tên field trùng với key JSON cũ nên định dạng file output không đổi.
+"""
+
+class Record:
+    __slots__ = ()
+
+    def __init__(self, *args, **kwargs):
+        for name, value in zip(self.__slots__, args):
+            object.__setattr__(self, name, value)
+        for name in self.__slots__[len(args):]:
+            object.__setattr__(self, name, kwargs.get(name))
+
+    def to_dict(self):
+        # Chỉ chuyển một cấp; record lồng bên trong được json.dumps chuyển tiếp qua default
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(getattr(self, n) == getattr(other, n) for n in self.__slots__)
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+def record_to_json(obj):
+    # Dùng làm `default` cho json.dump/json.dumps
+    if isinstance(obj, Record):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+# --- Listing info ---
+class Image(Record):
+    __slots__ = ("id", "orientation", "accessibilityLabel", "baseUrl")
+
+class RoomTourItem(Record):
+    __slots__ = ("title", "imageIds")
+
+class Rating(Record):
+    __slots__ = ("categoryType", "localizedRating", "percentage")
+
+class Highlight(Record):
+    __slots__ = ("title", "subtitle", "type")
+
+class Description(Record):
+    __slots__ = ("title", "htmlText")
+
+class Amenity(Record):
+    __slots__ = ("available", "title", "icon")
+
+class AmenityGroup(Record):
+    __slots__ = ("group_title", "amenities")
+
+# --- Reviews ---
+class Review(Record):
+    __slots__ = ("externalId", "pictureUrl", "firstName", "language", "createdAt", "rating", "comments")
+
+    def to_dict(self):
+        # Giữ định dạng cũ: thông tin người review nằm trong object "reviewer"
+        return {
+            "externalId": self.externalId,
+            "reviewer": {
+                "pictureUrl": self.pictureUrl,
+                "firstName": self.firstName
+            },
+            "language": self.language,
+            "createdAt": self.createdAt,
+            "rating": self.rating,
+            "comments": self.comments
+        }
+
+# --- Calendar ---
+class CalendarDay(Record):
+    __slots__ = ("calendarDate", "available", "availableForCheckin", "availableForCheckout",
+                 "bookable", "minNights", "maxNights", "priceFormatted")
+
+class CalendarMonth(Record):
+    __slots__ = ("month", "year", "days")
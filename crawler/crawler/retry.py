@@ -0,0 +1,139 @@
+import random
+import threading
+import time
+import requests
+from crawler.config import (
+    RETRY_MAX_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY,
+    RETRY_BUDGET_RATIO, RETRY_BUDGET_MIN_TOKENS, RETRY_BUDGET_MAX_TOKENS,
+    BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT
+)
+
+class CircuitOpenError(Exception):
+    # Operation đang bị ngắt mạch, request không được gửi đi
+    pass
+
+def _status_code(error):
+    response = getattr(error, "response", None)
+    return response.status_code if response is not None else None
+
+def is_retryable_error(error):
+    # Lỗi mạng, timeout, 429 và 5xx là lỗi tạm thời, có thể thử lại
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    status = _status_code(error)
+    return status is not None and (status == 429 or status >= 500)
+
+def is_breaker_failure(error):
+    # Ngoài các lỗi tạm thời, 403 (soft block) cũng tính là operation đang hỏng
+    return is_retryable_error(error) or _status_code(error) == 403
+
+class RetryPolicy:
+    """Exponential backoff với full jitter."""
+
+    def __init__(self, max_attempts=RETRY_MAX_ATTEMPTS, base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff(self, attempt, error=None):
+        # Tôn trọng Retry-After nếu server trả về, nhưng không chờ quá max_delay
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(self.max_delay, float(retry_after))
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+class RetryBudget:
+    """Giới hạn tổng số retry theo tỉ lệ với số request gốc.
+
+    Mỗi request gốc nạp `ratio` token, mỗi retry tiêu 1 token. Khi cả hệ thống
+    đang lỗi, budget cạn nhanh và retry dừng lại thay vì nhân số request lên.
+    """
+
+    def __init__(self, ratio=RETRY_BUDGET_RATIO, min_tokens=RETRY_BUDGET_MIN_TOKENS, max_tokens=RETRY_BUDGET_MAX_TOKENS):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self._tokens = float(min_tokens)
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def try_withdraw(self):
+        with self._lock:
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return True
+            return False
+
+class CircuitBreaker:
+    """Ngắt mạch cho một operation sau nhiều lỗi liên tiếp.
+
+    CLOSED -> OPEN sau `failure_threshold` lỗi liên tiếp. Sau `reset_timeout`
+    giây chuyển sang HALF_OPEN và cho đúng một request thử; thành công thì
+    CLOSED lại, thất bại thì OPEN thêm một chu kỳ.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_request(self):
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    raise CircuitOpenError(f"Circuit for {self.name} is open")
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == self.HALF_OPEN:
+                if self._trial_in_flight:
+                    raise CircuitOpenError(f"Circuit for {self.name} is half-open, waiting for trial request")
+                self._trial_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                print(f"[INFO] Circuit for {self.name} closed")
+            self.state = self.CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    print(f"[WARNING] Circuit for {self.name} opened after {self._failures} failures")
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+    def release(self):
+        # Request thử kết thúc mà không xác định được tình trạng operation (vd. lỗi 4xx)
+        with self._lock:
+            self._trial_in_flight = False
+
+class CircuitBreakerRegistry:
+    def __init__(self, **breaker_kwargs):
+        self._breaker_kwargs = breaker_kwargs
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, operation):
+        with self._lock:
+            breaker = self._breakers.get(operation)
+            if breaker is None:
+                breaker = CircuitBreaker(operation, **self._breaker_kwargs)
+                self._breakers[operation] = breaker
+            return breaker
@@ -0,0 +1,249 @@
+import gzip
+import io
+import json
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from crawler.config import SEGMENT_COMPACT_THRESHOLD, SEGMENT_ZSTD_LEVEL
+from crawler.jsonl_output import compact_jsonl, iter_records
+
+# zstandard là tuỳ chọn, không có thì nén segment bằng gzip
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Khoá file để nhiều process (vd. nhiều tỉnh chạy song song) cập nhật manifest lần lượt
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+CRAWLER_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SEGMENT_ROOT = os.path.join(CRAWLER_ROOT, "output", "segments")
+MANIFEST_FILE = "manifest.json"
+MANIFEST_LOCK_FILE = "manifest.json.lock"
+
+def _open_segment_writer(path, name):
+    # Định dạng nén theo tên segment (path có thể là file tạm)
+    if name.endswith(".zst"):
+        raw = open(path, 'wb')
+        return io.TextIOWrapper(zstandard.ZstdCompressor(level=SEGMENT_ZSTD_LEVEL).stream_writer(raw), encoding='utf-8')
+    return gzip.open(path, 'wt', encoding='utf-8')
+
+def _open_segment_reader(path):
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError(f"Segment {path} is zstd-compressed but the zstandard package is not installed")
+        raw = open(path, 'rb')
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(raw, closefd=True), encoding='utf-8')
+    return gzip.open(path, 'rt', encoding='utf-8')
+
+class SegmentStore:
+    """Kho output theo segment cho một loại dữ liệu (listing_info, review...).
+
+    - Mỗi segment là một file JSON Lines đã nén (zstd, hoặc gzip nếu thiếu zstandard),
+      ghi một lần và không sửa; trong một segment mỗi listing_id chỉ xuất hiện một lần.
+    - Record lỗi ({"error": ...}) không được đưa vào segment, để không đè record tốt của lần trước.
+    - manifest.json liệt kê các segment theo thứ tự cũ -> mới, ghi atomic; mọi lần sửa manifest
+      đều giữ khoá file manifest.json.lock nên an toàn khi nhiều process dùng chung kho.
+    - compact() gộp các segment thành một, record mới nhất của mỗi listing_id được giữ,
+      record cũ bị bỏ, nên dung lượng tỉ lệ với số listing còn sống chứ không với lịch sử.
+    """
+
+    def __init__(self, kind, root=DEFAULT_SEGMENT_ROOT):
+        self.kind = kind
+        self.dir = os.path.join(root, kind)
+        os.makedirs(self.dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._compaction = None
+
+    # --- Manifest ---
+    @contextmanager
+    def _locked(self):
+        # Khoá giữa các thread (threading.Lock) và giữa các process (khoá file)
+        with self._lock, open(os.path.join(self.dir, MANIFEST_LOCK_FILE), 'a+b') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+                else:
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def _load_manifest(self):
+        path = os.path.join(self.dir, MANIFEST_FILE)
+        if not os.path.exists(path):
+            return {"segments": [], "next_id": 1}
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _save_manifest(self, manifest):
+        path = os.path.join(self.dir, MANIFEST_FILE)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, path)
+
+    def _allocate_name(self):
+        # Cấp tên segment mới, phải gọi khi đang giữ _locked()
+        manifest = self._load_manifest()
+        segment_id = manifest["next_id"]
+        manifest["next_id"] = segment_id + 1
+        self._save_manifest(manifest)
+        extension = "jsonl.zst" if zstandard is not None else "jsonl.gz"
+        return f"segment_{segment_id:06d}.{extension}"
+
+    def segments(self):
+        with self._locked():
+            return [segment["name"] for segment in self._load_manifest()["segments"]]
+
+    # --- Ghi ---
+    def _write_segment(self, name, records):
+        path = os.path.join(self.dir, name)
+        tmp_path = f"{path}.tmp"
+        count = 0
+        with _open_segment_writer(tmp_path, name) as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+                count += 1
+        os.replace(tmp_path, path)
+        return count
+
+    def add_file(self, jsonl_filename, compacted=False, remove_source=True, merge=None):
+        """Chuyển file JSON Lines của một lần chạy thành segment mới, trả về tên segment.
+
+        compacted=True nếu file đã được compact_jsonl (mỗi listing_id một dòng).
+        Record lỗi bị bỏ qua. Nếu có merge(stored, record), mỗi record được ghép với
+        record mới nhất đã lưu của listing đó trước khi ghi (merge trả về None thì bỏ record).
+        """
+        if not compacted:
+            compact_jsonl(jsonl_filename)
+        records = (record for record in iter_records(jsonl_filename) if not record.get("error"))
+        if merge is not None:
+            stored = self.latest_for(record.get("listing_id") for record in iter_records(jsonl_filename))
+            merged = (merge(stored.get(record.get("listing_id")), record) for record in records)
+            records = (record for record in merged if record is not None)
+        with self._locked():
+            name = self._allocate_name()
+        count = self._write_segment(name, records)
+
+        with self._locked():
+            manifest = self._load_manifest()
+            manifest["segments"].append({"name": name, "records": count, "created_at": datetime.now().isoformat()})
+            self._save_manifest(manifest)
+
+        if remove_source:
+            os.remove(jsonl_filename)
+        print(f"[INFO] Added segment {name} ({count} records) to {self.dir}")
+        return name
+
+    # --- Đọc ---
+    def _iter_segment(self, name):
+        with _open_segment_reader(os.path.join(self.dir, name)) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def iter_latest(self, segment_names=None):
+        """Yield record mới nhất của mỗi listing_id, đọc từ segment mới nhất về cũ nhất.
+
+        Chỉ giữ tập listing_id đã gặp trong bộ nhớ, không giữ record. Record lỗi
+        (trong segment ghi trước khi add_file lọc lỗi) bị bỏ qua, record tốt cũ hơn được dùng.
+        """
+        fixed = segment_names is not None
+        seen = set()
+        done = set()
+        previous = None
+        while True:
+            names = segment_names if fixed else self.segments()
+            try:
+                for name in reversed(names):
+                    if name in done:
+                        continue
+                    for record in self._iter_segment(name):
+                        listing_id = record.get("listing_id")
+                        if listing_id in seen or record.get("error"):
+                            continue
+                        seen.add(listing_id)
+                        yield record
+                    done.add(name)
+                return
+            except FileNotFoundError:
+                # Manifest không đổi mà vẫn thiếu file thì kho bị hỏng, không thử lại
+                if fixed or names == previous:
+                    raise
+                previous = names
+                # Segment vừa bị process khác compact: đọc lại manifest, segment gộp mới nằm đầu danh sách
+                # nên chỉ trả về các listing chưa gặp
+                print(f"[INFO] Segments of {self.kind} changed while reading, reloading manifest")
+
+    def latest_for(self, listing_ids):
+        # dict listing_id -> record mới nhất, chỉ cho các listing được hỏi
+        wanted = set(listing_ids)
+        found = {}
+        if not wanted:
+            return found
+        for record in self.iter_latest():
+            if record.get("listing_id") in wanted:
+                found[record["listing_id"]] = record
+                if len(found) == len(wanted):
+                    break
+        return found
+
+    # --- Compaction ---
+    def compact(self):
+        """Gộp tất cả segment hiện có thành một segment. Segment được thêm trong lúc gộp vẫn giữ nguyên."""
+        merged = self.segments()
+        if len(merged) < 2:
+            return None
+
+        with self._locked():
+            name = self._allocate_name()
+        count = self._write_segment(name, self.iter_latest(merged))
+
+        with self._locked():
+            manifest = self._load_manifest()
+            current = set(segment["name"] for segment in manifest["segments"])
+            if not set(merged) <= current:
+                # Process khác đã compact các segment này trong lúc gộp, bỏ bản gộp của mình
+                os.remove(os.path.join(self.dir, name))
+                print(f"[INFO] Segments of {self.kind} were compacted by another process, discarding {name}")
+                return None
+            remaining = [segment for segment in manifest["segments"] if segment["name"] not in merged]
+            manifest["segments"] = [{"name": name, "records": count, "created_at": datetime.now().isoformat()}] + remaining
+            self._save_manifest(manifest)
+
+        # Segment cũ không còn trong manifest, reader đang mở vẫn đọc được đến khi đóng file
+        for old_name in merged:
+            try:
+                os.remove(os.path.join(self.dir, old_name))
+            except OSError as e:
+                print(f"[WARNING] Could not remove compacted segment {old_name}: {e}")
+        print(f"[INFO] Compacted {len(merged)} segments of {self.kind} into {name} ({count} live records)")
+        return name
+
+    def compact_in_background(self, threshold=SEGMENT_COMPACT_THRESHOLD):
+        # Chạy compact() trong thread riêng khi số segment vượt ngưỡng; process chờ thread xong trước khi thoát
+        if len(self.segments()) < threshold:
+            return None
+        if self._compaction is not None and self._compaction.is_alive():
+            return self._compaction
+
+        def run():
+            try:
+                self.compact()
+            except Exception as e:
+                print(f"[ERROR] Background compaction of {self.kind} failed: {e}")
+
+        self._compaction = threading.Thread(target=run, name=f"compact-{self.kind}")
+        self._compaction.start()
+        return self._compaction
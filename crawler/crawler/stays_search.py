@@ -0,0 +1,242 @@
+import copy
+from crawler.async_engine import run_concurrently
+from crawler.config import STAYS_SEARCH_MAX_PAGES, TILE_MAX_DEPTH, TILE_SEARCH_CONCURRENCY
+
+# Nới rộng khung bao quanh các listing tìm thấy để không bỏ sót vùng rìa (tỉ lệ theo kích thước khung)
+_BOUNDS_PADDING = 0.1
+
+# Header của request gốc không nên gửi lại nguyên văn
+_SKIPPED_HEADERS = {"host", "content-length", "accept-encoding", "connection", "cookie"}
+
+def build_search_template(request):
+    # Lưu lại url (đã chứa hash), body JSON và header của request StaysSearch bắt được từ browser
+    return {
+        "url": request.url,
+        "body": request.post_data_json,
+        "headers": {k: v for k, v in request.headers.items() if not k.startswith(":") and k.lower() not in _SKIPPED_HEADERS}
+    }
+
+def _set_cursor(body, cursor):
+    # StaysSearch nhận cursor ở cả request danh sách và request bản đồ
+    variables = body.setdefault("variables", {})
+    for key in ("staysSearchRequest", "staysMapSearchRequestV2"):
+        if key in variables:
+            if cursor:
+                variables[key]["cursor"] = cursor
+            else:
+                variables[key].pop("cursor", None)
+
+def _set_bounds(body, bounds):
+    # Giới hạn tìm kiếm trong khung bản đồ (sw_lat, sw_lng, ne_lat, ne_lng).
+    # Trả về False nếu body không có request nào để gán khung
+    sw_lat, sw_lng, ne_lat, ne_lng = bounds
+    params = {
+        "ne_lat": str(ne_lat), "ne_lng": str(ne_lng),
+        "sw_lat": str(sw_lat), "sw_lng": str(sw_lng),
+        "search_by_map": "true", "search_type": "user_map_move"
+    }
+    variables = body.setdefault("variables", {})
+    patched = False
+    for key in ("staysSearchRequest", "staysMapSearchRequestV2"):
+        if key not in variables:
+            continue
+        raw_params = [p for p in variables[key].get("rawParams", []) if p.get("filterName") not in params]
+        raw_params.extend({"filterName": name, "filterValues": [value]} for name, value in params.items())
+        variables[key]["rawParams"] = raw_params
+        patched = True
+    return patched
+
+def extract_listing_ids(response_data):
+    stays = response_data.get("data", {})\
+                         .get("presentation", {})\
+                         .get("staysSearch", {})\
+                         .get("mapResults", {})\
+                         .get("staysInViewport", [])
+    return [stay["listingId"] for stay in stays if stay.get("listingId") not in (None, "None")]
+
+def next_page_cursor(response_data):
+    return response_data.get("data", {})\
+                        .get("presentation", {})\
+                        .get("staysSearch", {})\
+                        .get("results", {})\
+                        .get("paginationInfo", {})\
+                        .get("nextPageCursor")
+
+def iter_coordinates(data):
+    # Tìm tất cả toạ độ {latitude, longitude} trong response, không phụ thuộc cấu trúc cụ thể
+    if isinstance(data, dict):
+        lat, lng = data.get("latitude"), data.get("longitude")
+        if isinstance(lat, (int, float)) and isinstance(lng, (int, float)):
+            yield lat, lng
+        for value in data.values():
+            yield from iter_coordinates(value)
+    elif isinstance(data, list):
+        for value in data:
+            yield from iter_coordinates(value)
+
+# Tên key của khung bản đồ (ne/sw) có thể gặp trong response và trong rawParams của request
+_BOUNDS_KEYS = (("sw_lat", "sw_lng", "ne_lat", "ne_lng"), ("swLat", "swLng", "neLat", "neLng"))
+
+def _as_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def _lat_lng(point):
+    if not isinstance(point, dict):
+        return None
+    lat = _as_float(point.get("lat", point.get("latitude")))
+    lng = _as_float(point.get("lng", point.get("longitude")))
+    return (lat, lng) if lat is not None and lng is not None else None
+
+def iter_map_bounds(data):
+    # Tìm tất cả khung bản đồ (sw_lat, sw_lng, ne_lat, ne_lng) trong response/request, không phụ thuộc cấu trúc cụ thể
+    if isinstance(data, dict):
+        for keys in _BOUNDS_KEYS:
+            values = [_as_float(data.get(key)) for key in keys]
+            if all(value is not None for value in values):
+                yield tuple(values)
+        ne = _lat_lng(data.get("northeast", data.get("ne")))
+        sw = _lat_lng(data.get("southwest", data.get("sw")))
+        if ne and sw:
+            yield (sw[0], sw[1], ne[0], ne[1])
+        # rawParams: [{"filterName": "ne_lat", "filterValues": ["..."]}, ...]
+        raw_params = data.get("rawParams")
+        if isinstance(raw_params, list):
+            params = {p.get("filterName"): (p.get("filterValues") or [None])[0] for p in raw_params if isinstance(p, dict)}
+            yield from iter_map_bounds({key: params.get(key) for key in _BOUNDS_KEYS[0]})
+        for value in data.values():
+            if isinstance(value, (dict, list)) and value is not raw_params:
+                yield from iter_map_bounds(value)
+    elif isinstance(data, list):
+        for value in data:
+            yield from iter_map_bounds(value)
+
+def _area(bounds):
+    sw_lat, sw_lng, ne_lat, ne_lng = bounds
+    return (ne_lat - sw_lat) * (ne_lng - sw_lng)
+
+def union_bounds(boxes):
+    boxes = [box for box in boxes if box is not None]
+    if not boxes:
+        return None
+    return (min(b[0] for b in boxes), min(b[1] for b in boxes), max(b[2] for b in boxes), max(b[3] for b in boxes))
+
+def bounding_box(coordinates):
+    coordinates = list(coordinates)
+    if not coordinates:
+        return None
+    lats = [lat for lat, _ in coordinates]
+    lngs = [lng for _, lng in coordinates]
+    pad_lat = (max(lats) - min(lats)) * _BOUNDS_PADDING or 0.01
+    pad_lng = (max(lngs) - min(lngs)) * _BOUNDS_PADDING or 0.01
+    return (min(lats) - pad_lat, min(lngs) - pad_lng, max(lats) + pad_lat, max(lngs) + pad_lng)
+
+def split_bounds(bounds):
+    # Chia một khung thành 4 ô bằng nhau
+    sw_lat, sw_lng, ne_lat, ne_lng = bounds
+    mid_lat = (sw_lat + ne_lat) / 2
+    mid_lng = (sw_lng + ne_lng) / 2
+    return [
+        (sw_lat, sw_lng, mid_lat, mid_lng),
+        (sw_lat, mid_lng, mid_lat, ne_lng),
+        (mid_lat, sw_lng, ne_lat, mid_lng),
+        (mid_lat, mid_lng, ne_lat, ne_lng)
+    ]
+
+def iter_search_pages(template, client, max_pages=STAYS_SEARCH_MAX_PAGES, body=None):
+    # Gọi thẳng StaysSearch theo cursor, yield response của từng trang (không cần browser)
+    body = copy.deepcopy(body if body is not None else template["body"])
+    cursor = None
+    for _ in range(max_pages):
+        _set_cursor(body, cursor)
+        response_data = client.post_json("StaysSearch", template["url"], body, template["headers"])
+        yield response_data
+
+        cursor = next_page_cursor(response_data)
+        if not cursor:
+            break
+
+def iter_listing_ids(template, client, max_pages=STAYS_SEARCH_MAX_PAGES):
+    """Yield listingId của tất cả các trang kết quả, theo cursor phân trang."""
+    for page_index, response_data in enumerate(iter_search_pages(template, client, max_pages)):
+        new_ids = extract_listing_ids(response_data)
+        print(f"[INFO] API page {page_index+1}: found {len(new_ids)} listingId(s)")
+        yield from new_ids
+
+def search_pages(template, client, max_pages=STAYS_SEARCH_MAX_PAGES, bounds=None):
+    """Tìm tất cả các trang, trả về (listing_ids, coordinates, map_bounds, saturated).
+
+    saturated = True khi đã lấy đủ `max_pages` trang: Airbnb giới hạn số trang của một
+    lần tìm kiếm và trang cuối ở giới hạn không có nextPageCursor, nên không thể dựa vào
+    cursor để biết khu vực còn kết quả hay không.
+    map_bounds là các khung bản đồ tìm thấy trong response (vd. khung của tỉnh).
+    """
+    body = copy.deepcopy(template["body"])
+    if bounds is not None:
+        _set_bounds(body, bounds)
+
+    listing_ids, coordinates, map_bounds = [], [], []
+    pages = 0
+    for response_data in iter_search_pages(template, client, max_pages, body):
+        pages += 1
+        listing_ids.extend(extract_listing_ids(response_data))
+        coordinates.extend(iter_coordinates(response_data))
+        map_bounds.extend(iter_map_bounds(response_data))
+    return listing_ids, coordinates, map_bounds, pages >= max_pages
+
+def search_by_tiles(template, client, max_pages=STAYS_SEARCH_MAX_PAGES, max_depth=TILE_MAX_DEPTH, concurrency=TILE_SEARCH_CONCURRENCY):
+    """Tìm listing của một tỉnh bằng cách chia khung bản đồ thành các ô.
+
+    Khung ban đầu là khung bản đồ lớn nhất tìm thấy trong response/request tìm kiếm theo
+    tên tỉnh (khung của tỉnh), gộp với khung bao các listing tìm thấy. Ô nào
+    vẫn chạm giới hạn số trang và có listing mới sẽ được chia tiếp thành 4 ô, tối đa
+    `max_depth` lần; ô không có listing mới (vd. server bỏ qua khung) thì không chia nữa.
+    Các ô cùng cấp được tìm song song; listing ID được gộp và loại trùng trong bộ nhớ.
+    """
+    ids, coordinates, map_bounds, saturated = search_pages(template, client, max_pages)
+    listing_ids = set(ids)
+    print(f"[INFO] Initial search: {len(listing_ids)} listingId(s)")
+    if not saturated:
+        return listing_ids
+
+    map_bounds = [box for box in map_bounds + list(iter_map_bounds(template["body"])) if _area(box) > 0]
+    province_bounds = max(map_bounds, key=_area) if map_bounds else None
+    if province_bounds is None:
+        print("[WARNING] No map bounds in search response, tiling the area around found listings only")
+    bounds = union_bounds([province_bounds, bounding_box(coordinates)])
+    if bounds is None:
+        print("[WARNING] No coordinates in search results, cannot split into tiles")
+        return listing_ids
+    if not _set_bounds(copy.deepcopy(template["body"]), bounds):
+        print("[WARNING] Search request has no staysSearchRequest/staysMapSearchRequestV2 to set map bounds on, cannot split into tiles")
+        return listing_ids
+    print(f"[INFO] Tiling bounds: {bounds}")
+
+    tiles = [(tile, 1) for tile in split_bounds(bounds)]
+    while tiles:
+        next_tiles = []
+
+        def on_result(index, item, result, error):
+            tile, depth = item
+            if error:
+                print(f"[ERROR] Tile {tile} failed: {error}")
+                return
+            tile_ids, _, _, tile_saturated = result
+            new_ids = set(tile_ids) - listing_ids
+            listing_ids.update(new_ids)
+            print(f"[INFO] Tile depth {depth}: {len(tile_ids)} listingId(s), {len(new_ids)} new, total {len(listing_ids)}")
+            if tile_saturated and not new_ids:
+                # Chia nhỏ ô không thêm được listing nào thì các ô con cũng chỉ trả lại cùng các trang đó
+                print(f"[WARNING] Tile {tile} saturated but found no new listings, not splitting")
+            elif tile_saturated:
+                if depth < max_depth:
+                    next_tiles.extend((sub_tile, depth + 1) for sub_tile in split_bounds(tile))
+                else:
+                    print(f"[WARNING] Tile {tile} still saturated at max depth {max_depth}")
+
+        run_concurrently(tiles, lambda item: search_pages(template, client, max_pages, item[0]), concurrency, on_result)
+        tiles = next_tiles
+
+    return listing_ids
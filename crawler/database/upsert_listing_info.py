@@ -11,7 +11,9 @@ import unicodedata
 
 # Thêm đường dẫn để có thể import local modules
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from snowflake_ID_generator import generate_snowflake_uid
+from crawler.jsonl_output import iter_records
 
 # Load environment variables from ../.env
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '../.env'))
@@ -728,12 +730,10 @@ def load_reviews_data(reviews_file):
         return reviews_dict
     
     try:
-        with open(reviews_file, 'r', encoding='utf-8') as f:
-            reviews_data_list = json.load(f)
+        # Đọc từng record, chỉ giữ lại reviews (không giữ cả danh sách record)
+        print(f"[INFO] Loading reviews from {reviews_file}...")
 
-        print(f"[INFO] Loading reviews from {len(reviews_data_list)} listings...")
-
-        for item in reviews_data_list:
+        for item in iter_records(reviews_file):
             listing_id = item.get('listing_id')
             data = item.get('data', {})
             reviews = data.get('reviews', [])
@@ -769,19 +769,16 @@ def main():
         # Load reviews data
         reviews_dict = load_reviews_data(reviews_file)
         
-        # Đọc listing info (đã bao gồm price data)
-        with open(listing_info_file, 'r', encoding='utf-8') as f:
-            listing_data_list = json.load(f)
-
-        print(f"[INFO] Processing {len(listing_data_list)} listings...")
+        # Đọc lần lượt từng listing info (đã bao gồm price data), không tải cả file vào bộ nhớ
+        print(f"[INFO] Processing listings from {listing_info_file}...")
 
         success_count = 0
         error_count = 0
         skipped_count = 0
         
-        for i, listing_data in enumerate(listing_data_list):
+        for i, listing_data in enumerate(iter_records(listing_info_file)):
             listing_id = listing_data.get('listing_id', '')
-            print(f"[INFO] Processing listing {i+1}/{len(listing_data_list)}: {listing_id}")
+            print(f"[INFO] Processing listing {i+1}: {listing_id}")
 
             # Upsert vào cả MySQL và MongoDB (bao gồm reviews)
             result = upsert_product_from_listing_data(listing_data, mongodb_db, reviews_dict)
@@ -10,7 +10,9 @@ from dotenv import load_dotenv
 
 # Thêm đường dẫn để có thể import local modules
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from snowflake_ID_generator import generate_snowflake_uid
+from crawler.jsonl_output import iter_records
 
 # Load environment variables from ../.env
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '../.env'))
@@ -636,19 +638,16 @@ def main(listing_info_file):
         else:
             print("[WARNING] MongoDB connection failed, will only update MySQL")
         
-        # Đọc listing info (đã bao gồm price data)
-        with open(listing_info_file, 'r', encoding='utf-8') as f:
-            listing_data_list = json.load(f)
-
-        print(f"\n[INFO] Processing {len(listing_data_list)} listings...")
+        # Đọc lần lượt từng listing info (đã bao gồm price data), không tải cả file vào bộ nhớ
+        print(f"\n[INFO] Processing listings from {listing_info_file}...")
 
         success_count = 0
         error_count = 0
         skipped_count = 0
         
-        for i, listing_data in enumerate(listing_data_list):
+        for i, listing_data in enumerate(iter_records(listing_info_file)):
             listing_id = listing_data.get('listing_id', '')
-            print(f"[INFO] Processing listing {i+1}/{len(listing_data_list)}: {listing_id}")
+            print(f"[INFO] Processing listing {i+1}: {listing_id}")
 
             # Upsert vào cả MySQL và MongoDB
             result = upsert_product_from_listing_data(listing_data, mongodb_db)
@@ -673,6 +672,6 @@ if __name__ == "__main__":
         listing_info_file = sys.argv[1]
         print(f"[INFO] Using file: {listing_info_file}")
     else:
-        print("[INFO] Example: python upsert_room_info.py output/crawled_data/listing_info_20250812001.json")
+        print("[INFO] Example: python upsert_room_info.py output/crawled_data/listing_info_20250812001.jsonl")
 
     main(listing_info_file)
@@ -7,6 +7,10 @@ import os
 import sys
 from dotenv import load_dotenv
 
+# Thêm thư mục gốc crawler vào Python path để dùng chung reader file output
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from crawler.jsonl_output import iter_records
+
 # Load environment variables from ../.env
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '../.env'))
 
@@ -37,11 +41,13 @@ def get_db_connection():
         print(f"[ERROR] Can't connect to MySQL: {e}")
         return None
 
-def connect_to_mongodb():
-    # Kết nối đến MongoDB
+def connect_to_mongodb(server_selection_timeout_ms=None):
+    # Kết nối đến MongoDB; MongoClient kết nối lazy nên ping để chắc server đang chạy
     try:
-        client = MongoClient(MONGODB_CONFIG['uri'])
+        options = {'serverSelectionTimeoutMS': server_selection_timeout_ms} if server_selection_timeout_ms else {}
+        client = MongoClient(MONGODB_CONFIG['uri'], **options)
         db = client[MONGODB_CONFIG['database']]
+        db.command('ping')
         print("[INFO] Connected to MongoDB successfully!")
         return db
     except Exception as e:
@@ -139,6 +145,59 @@ def upsert_reviews_to_mongodb(db, product_id, listing_id, reviews_data):
         print(f"[ERROR] Error upserting reviews to MongoDB for listing {listing_id}: {e}")
         raise
 
+def append_reviews_to_mongodb(db, product_id, listing_id, reviews_data):
+    # Thêm các review mới (chưa có externalId trong document) lên đầu danh sách reviews đã lưu
+    try:
+        collection = db['reviews']
+
+        existing_doc = collection.find_one({'ProductID': product_id}, {'reviews.externalId': 1})
+        existing_ids = set(review.get('externalId') for review in existing_doc.get('reviews', [])) if existing_doc else set()
+
+        new_reviews = []
+        for review in reviews_data:
+            processed_review = extract_review_data(review)
+            if processed_review['externalId'] in existing_ids:
+                continue
+            existing_ids.add(processed_review['externalId'])
+            new_reviews.append(processed_review)
+
+        if not new_reviews:
+            print(f"[INFO] MongoDB Reviews of listing {listing_id}: no new reviews, skipping update")
+            return False
+
+        result = collection.update_one(
+            {'ProductID': product_id},
+            {
+                '$push': {'reviews': {'$each': new_reviews, '$position': 0}},
+                '$inc': {'total_reviews': len(new_reviews)},
+                '$set': {'updated_at': datetime.now()},
+                '$setOnInsert': {'Source': 'airbnb'}
+            },
+            upsert=True
+        )
+
+        action = "inserted" if result.upserted_id else "appended"
+        print(f"[INFO] MongoDB Reviews of listing {listing_id}: {action} {len(new_reviews)} new reviews")
+        return True
+
+    except Exception as e:
+        print(f"[ERROR] Error appending reviews to MongoDB for listing {listing_id}: {e}")
+        raise
+
+def get_known_review_ids(db, product_id, listing_id):
+    # Tập externalId của các review đã lưu cho listing, dùng để dừng phân trang khi fetch reviews
+    # Lỗi thì trả về tập rỗng: listing được lấy toàn bộ reviews, review trùng bị bỏ khi upsert
+    if product_id is None:
+        return set()
+    try:
+        existing_doc = db['reviews'].find_one({'ProductID': product_id}, {'reviews.externalId': 1})
+    except Exception as e:
+        print(f"[WARNING] Cannot read stored reviews of listing {listing_id}: {e}")
+        return set()
+    if not existing_doc:
+        return set()
+    return set(review.get('externalId') for review in existing_doc.get('reviews', []))
+
 def create_reviews_mongodb_indexes(db):
     # Tạo indexes cho collection reviews để tối ưu hiệu suất
     try:
@@ -167,34 +226,44 @@ def create_reviews_mongodb_indexes(db):
     except Exception as e:
         print(f"[ERROR] Error creating indexes for reviews collection: {e}")
 
-def load_reviews_data(reviews_file):
-    # Đọc dữ liệu reviews và tạo dictionary mapping listing_id -> reviews
-    reviews_dict = {}
-    
-    if not os.path.exists(reviews_file):
-        print(f"[ERROR] File {reviews_file} not found!")
-        return reviews_dict
-    
-    try:
-        with open(reviews_file, 'r', encoding='utf-8') as f:
-            reviews_data_list = json.load(f)
+def iter_reviews_data(reviews_file):
+    # Đọc lần lượt từng record reviews, yield (listing_id, reviews, append) cho listing có reviews.
+    # append=True với record chỉ chứa review mới (fetch theo trang), được ghép vào reviews đã lưu
+    for item in iter_records(reviews_file):
+        listing_id = item.get('listing_id')
+        data = item.get('data', {})
+        reviews = data.get('reviews', [])
+        
+        if listing_id and reviews:
+            yield listing_id, reviews, item.get('merge') == 'append'
 
-        print(f"[INFO] Loading reviews from {len(reviews_data_list)} listings...")
+def get_product_ids(listing_ids):
+    # Lấy ProductID của nhiều listing bằng một kết nối MySQL, trả về dict listing_id -> ProductID
+    listing_ids = [str(listing_id) for listing_id in listing_ids]
+    if not listing_ids:
+        return {}
+    connection = get_db_connection()
+    if not connection:
+        print("[ERROR] Cannot connect to MySQL to look up ProductIDs")
+        return {}
 
-        for item in reviews_data_list:
-            listing_id = item.get('listing_id')
-            data = item.get('data', {})
-            reviews = data.get('reviews', [])
-            
-            if listing_id and reviews:
-                reviews_dict[listing_id] = reviews
-        
-        print(f"[INFO] Loaded reviews for {len(reviews_dict)} listings")
-        return reviews_dict
-        
+    product_ids = {}
+    try:
+        cursor = connection.cursor()
+        for start in range(0, len(listing_ids), 500):
+            batch = listing_ids[start:start + 500]
+            cursor.execute(
+                f"SELECT ExternalID, ProductID FROM Products WHERE ExternalID IN ({', '.join(['%s'] * len(batch))})",
+                batch
+            )
+            product_ids.update((str(external_id), product_id) for external_id, product_id in cursor.fetchall())
+        cursor.close()
+        print(f"[INFO] Found ProductID for {len(product_ids)}/{len(listing_ids)} listings")
     except Exception as e:
-        print(f"[ERROR] Error loading reviews file {reviews_file}: {e}")
-        return reviews_dict
+        print(f"[ERROR] Error querying ProductIDs: {e}")
+    finally:
+        connection.close()
+    return product_ids
 
 def get_product_id_from_listing_id(listing_id):
     # Lấy ProductID từ listing_id bằng cách query bảng Products
@@ -241,20 +310,14 @@ def main(reviews_file):
         # Tạo indexes cho reviews collection
         create_reviews_mongodb_indexes(mongodb_db)
         
-        # Load reviews data
-        reviews_dict = load_reviews_data(reviews_file)
-        
-        if not reviews_dict:
-            print("[WARNING] No reviews data found!")
-            return
-
-        print(f"\n[INFO] Processing reviews for {len(reviews_dict)} listings...")
+        print(f"\n[INFO] Processing reviews from {reviews_file}...")
 
         success_count = 0
         error_count = 0
         
-        for i, (listing_id, reviews_data) in enumerate(reviews_dict.items()):
-            print(f"[INFO] Processing reviews {i+1}/{len(reviews_dict)}: listing {listing_id}")
+        # Đọc và upsert lần lượt từng listing, không tải cả file vào bộ nhớ
+        for i, (listing_id, reviews_data, append) in enumerate(iter_reviews_data(reviews_file)):
+            print(f"[INFO] Processing reviews {i+1}: listing {listing_id}")
 
             # Cần lấy ProductID từ listing_id
             product_id = get_product_id_from_listing_id(listing_id)
@@ -265,14 +328,21 @@ def main(reviews_file):
                 continue
             
             try:
-                # Upsert reviews vào MongoDB
-                upsert_reviews_to_mongodb(mongodb_db, product_id, listing_id, reviews_data)
+                # Upsert reviews vào MongoDB (ghép thêm nếu record chỉ chứa review mới)
+                if append:
+                    append_reviews_to_mongodb(mongodb_db, product_id, listing_id, reviews_data)
+                else:
+                    upsert_reviews_to_mongodb(mongodb_db, product_id, listing_id, reviews_data)
                 success_count += 1
                 
             except Exception as e:
                 print(f"[ERROR] Error processing reviews for listing {listing_id}: {e}")
                 error_count += 1
 
+        if success_count + error_count == 0:
+            print("[WARNING] No reviews data found!")
+            return
+
         print(f"\nCompleted! Processed {success_count} reviews, {error_count} errors")
 
     except Exception as e:
@@ -287,6 +357,6 @@ if __name__ == "__main__":
         reviews_file = sys.argv[1]
         print(f"[INFO] Using file: {reviews_file}")
     else:
-        print("[INFO] Example: python upsert_room_review.py output/crawled_data/review_20250812001.json")
+        print("[INFO] Example: python upsert_room_review.py output/crawled_data/review_20250812001.jsonl")
 
     main(reviews_file)
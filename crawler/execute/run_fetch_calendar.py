@@ -1,63 +1,39 @@
+import argparse
 import json
 import os
 import sys
+from datetime import datetime
 
 # Thêm thư mục cha vào Python path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from crawler.graphql_hashes import extract_sha256_hashes
-from crawler.fetch_calendar import fetch_calendar, extract_calendar_data
-from crawler.config import API_DOMAIN
+from crawler.hash_cache import get_valid_hashes, HashRegistry
+from crawler.fetch_calendar import fetch_calendar_window, extract_calendar_data
+from crawler.frontier import Frontier
+from crawler.config import API_DOMAIN, RAW_STORE_ENABLED
+from crawler.http_client import CrawlerClient, is_transient_failure
+from crawler.raw_store import RawPayloadStore
+from crawler.records import record_to_json
 
-def read_listing_ids():
-    # Đọc danh sách listing IDs từ file
-    listing_ids = []
-    file_path = "output/listing_ids.txt"
-    
-    if not os.path.exists(file_path):
-        print(f"[ERROR] File {file_path} is not found!")
-        return []
-    
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            for line in f:
-                line = line.strip()
-                if line:
-                    listing_ids.append(line)
-        print(f"[INFO] Read {len(listing_ids)} listing IDs from file")
-        return listing_ids
-    except Exception as e:
-        print(f"[ERROR] Error reading file: {e}")
-        return []
-
-def get_valid_hashes(listing_ids):
-    # Lấy hash từ listing_id đầu tiên có thể, nếu lỗi thì thử tiếp
-    for i, listing_id in enumerate(listing_ids):
-        try:
-            hashes = extract_sha256_hashes(listing_id)
-            # Kiểm tra xem có lấy được hash cho calendar không
-            if hashes.get("PdpAvailabilityCalendar"):
-                return hashes
-            else:
-                print(f"[WARNING] No calendar hash from listing_id: {listing_id}")
-        except Exception as e:
-            print(f"[ERROR] Error getting hash from listing_id {listing_id}: {e}")
-            continue
-
-    print("[ERROR] Could not get hash from any listing_id!")
-    return None
+# Tên stage trong frontier
+STAGE = "calendar"
+# File output, được upsert vào MongoDB ngay sau khi fetch
+CALENDARS_FILE = os.path.join("output", "listing_calendar.json")
 
 def save_to_json(data, filename):
     # Lưu dữ liệu vào file JSON
     try:
         with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+            json.dump(data, f, ensure_ascii=False, indent=2, default=record_to_json)
         print(f"[SUCCESS] Saved data to {filename}")
     except Exception as e:
         print(f"[ERROR] Error saving file {filename}: {e}")
 
-def process_calendar(listing_ids, hashes):
-    # Xử lý fetch calendar cho tất cả listing_ids
+def process_calendar(listing_ids, hashes, client, frontier=None, incremental=True):
+    # Xử lý fetch calendar cho tất cả listing_ids.
+    # incremental: listing có calendar đã upsert thành công vào MongoDB chỉ lấy các tháng gần và các tháng
+    # mới xuất hiện kể từ lần fetch của calendar đó; record được đánh dấu merge=months để upsert ghép vào
+    # calendar đã lưu. fetched_at của record được upsert ghi lại vào frontier sau khi lưu thành công
     print(f"\n[INFO] Starting fetch calendar for {len(listing_ids)} listings...")
     
     hash_val = hashes.get("PdpAvailabilityCalendar")
@@ -66,19 +42,31 @@ def process_calendar(listing_ids, hashes):
         return
     
     all_calendar_data = []
+    last_fetches = frontier.calendar_stored_times(listing_ids) if frontier and incremental else {}
+    print(f"[INFO] {len(last_fetches)} listings fetched incrementally, {len(listing_ids) - len(last_fetches)} in full")
     
     for i, listing_id in enumerate(listing_ids):
         print(f"[INFO] Fetching calendar {i+1}/{len(listing_ids)}: {listing_id}")
         try:
-            calendar_months = fetch_calendar(listing_id, hash_val, "", API_DOMAIN)
+            last_fetch = last_fetches.get(listing_id)
+            fetched_at = datetime.now().isoformat()
+            calendar_months = fetch_calendar_window(listing_id, hash_val, "", API_DOMAIN, client, last_fetch)
             calendar_info = extract_calendar_data(calendar_months, listing_id)
-            all_calendar_data.append({
+            record = {
                 "listing_id": listing_id,
-                "calendar_data": calendar_info
-            })
+                "calendar_data": calendar_info,
+                "fetched_at": fetched_at
+            }
+            if last_fetch is not None:
+                record["merge"] = "months"
+            all_calendar_data.append(record)
+            if frontier:
+                frontier.mark_fetched(listing_id, STAGE)
             print(f"[SUCCESS] Got calendar successfully for {listing_id}\n")
         except Exception as e:
             print(f"[ERROR] Error fetching calendar for {listing_id}: {e}\n")
+            if frontier:
+                frontier.record_result(listing_id, STAGE, e, is_transient_failure(e))
             # Thêm entry rỗng để theo dõi
             all_calendar_data.append({
                 "listing_id": listing_id,
@@ -87,22 +75,25 @@ def process_calendar(listing_ids, hashes):
             })
             continue
     
-    save_to_json(all_calendar_data, "output/listing_calendar.json")
+    save_to_json(all_calendar_data, CALENDARS_FILE)
 
-def main():
+def main(incremental=True):
     print("=== FETCH CALENDAR ===")
     
-    # 1. Đọc listing_ids từ file
-    listing_ids = read_listing_ids()
+    # 1. Lấy các listing cần crawl (mọi tỉnh) từ frontier
+    frontier = Frontier()
+    listing_ids = frontier.pull(STAGE)
     if not listing_ids:
-        print("[ERROR] No listing IDs found to process!")
+        print("[INFO] No listings need work for this stage")
+        frontier.close()
         return
     
     # 2. Lấy hash từ listing_id đầu tiên có thể
     print(f"\n[INFO] Fetching hash...")
-    hashes = get_valid_hashes(listing_ids)
+    hashes = get_valid_hashes(listing_ids, required=("PdpAvailabilityCalendar",))
     if not hashes:
         print("[ERROR] No valid hash found, stopping program!")
+        frontier.close()
         return
     
     # 3. Tạo thư mục output nếu chưa có
@@ -110,12 +101,28 @@ def main():
     
     # 4. Xử lý calendar
     try:
-        process_calendar(listing_ids, hashes)
+        with CrawlerClient(raw_store=RawPayloadStore() if RAW_STORE_ENABLED else None,
+                           hash_registry=HashRegistry(hashes, listing_ids)) as client:
+            process_calendar(listing_ids, hashes, client, frontier, incremental)
+            print(f"[INFO] Final request rates (req/s): {client.rates()}")
         print("\n=== COMPLETED FETCH CALENDAR ===")
-        print("File created: output/listing_calendar.json")
+        print(f"File created: {CALENDARS_FILE}")
+
+        # 5. Upsert calendar vào MongoDB; listing upsert thành công được ghi vào frontier
+        # để lần chạy sau chỉ fetch các tháng còn thiếu
+        from database.upsert_calendars_to_mongodb import main as upsert_calendars
+        upsert_calendars(CALENDARS_FILE, frontier)
+        print("\n=== COMPLETED UPSERT CALENDAR ===")
         
     except Exception as e:
         print(f"[ERROR] Error occurred during processing: {e}")
+    finally:
+        frontier.close()
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Fetch availability calendars for listings in the frontier")
+    parser.add_argument("--full", action="store_true",
+                        help="Fetch the whole calendar window for every listing instead of only near-term and new months")
+    args = parser.parse_args()
+
+    main(incremental=not args.full)
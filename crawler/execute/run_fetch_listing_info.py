@@ -1,4 +1,4 @@
-import json
+import argparse
 import os
 import sys
 from datetime import datetime
@@ -6,110 +6,85 @@ from datetime import datetime
 # Thêm thư mục cha vào Python path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from crawler.graphql_hashes import extract_sha256_hashes
-from crawler.fetch_listing_info import fetch_listing_info, extract_listing_data, fetch_price
+from crawler.hash_cache import get_valid_hashes, HashRegistry
+from crawler.fetch_listing_info import fetch_listing_info, extract_listing_data, fetch_price, merge_listing_data, section_handlers
+from crawler.fetch_calendar import fetch_calendar
+from crawler.frontier import Frontier
 from crawler.headers import encode_listing_id
-from crawler.config import API_DOMAIN
+from crawler.checkpoint import Checkpointer, find_latest_checkpoint
+from crawler.jsonl_output import JsonlWriter, compact_jsonl
+from crawler.config import API_DOMAIN, CHECKPOINT_EVERY, FETCH_CONCURRENCY, LISTING_REFRESH_SECTIONS, PRICE_CALENDAR_MONTHS, PRICE_PROBE_WAVE, RAW_STORE_ENABLED, SEGMENT_STORE_ENABLED
+from crawler.async_engine import run_concurrently
+from crawler.price_probe import ProbeStats, pick_stay_dates
+from crawler.http_client import CrawlerClient, is_transient_failure
+from crawler.raw_store import RawPayloadStore
+from crawler.segment_store import SegmentStore
 from crawler.utils import generate_date_sequence_number
 
-def read_listing_ids(province):
-    # Đọc danh sách listing IDs từ file
-    listing_ids = []
-    
-    # Lấy đường dẫn tới thư mục gốc của crawler (thư mục cha của execute)
-    crawler_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    file_path = os.path.join(crawler_root, "output", "listing_ids", f"listing_ids_{province}.txt")
-    
-    if not os.path.exists(file_path):
-        print(f"[ERROR] File {file_path} is not found!")
-        return []
-    
+# Tên stage trong frontier
+STAGE = "listing_info"
+
+def get_calendar_stay_dates(listing_id, calendar_hash, client):
+    # Lấy các cặp ngày đặt được từ calendar mấy tháng tới để stayCheckout không phải đoán
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            for line in f:
-                line = line.strip()
-                if line:
-                    listing_ids.append(line)
-        print(f"[INFO] Read {len(listing_ids)} listing IDs from file")
-        return listing_ids
+        calendar_months = fetch_calendar(listing_id, calendar_hash, "", API_DOMAIN, client, count=PRICE_CALENDAR_MONTHS)
+        return pick_stay_dates(calendar_months, max_candidates=PRICE_PROBE_WAVE)
     except Exception as e:
-        print(f"[ERROR] Error reading file: {e}")
-        return []
+        print(f"[WARNING] Could not fetch calendar for price dates of listing {listing_id}: {e}")
+        return None
+
+def fetch_listing_payload(listing_id, listing_hash, price_hash, client, probe_stats=None, province=None, calendar_hash=None, section_types=None):
+    # Gọi StaysPdpSections và stayCheckout cho một listing (chạy được trong worker thread)
+    encoded_id = encode_listing_id(listing_id)
+    sections = fetch_listing_info(listing_id, listing_hash, encoded_id, API_DOMAIN, client, section_types)
+    price_data = None
+    if price_hash:
+        stay_dates = get_calendar_stay_dates(listing_id, calendar_hash, client) if calendar_hash else None
+        price_data = fetch_price(listing_id, price_hash, encoded_id, API_DOMAIN, client,
+                                 probe_stats=probe_stats, scope=province, stay_dates=stay_dates)
+    return sections, price_data
 
-def get_valid_hashes(listing_ids):
-    # Lấy hash từ listing_id đầu tiên có thể, nếu lỗi thì thử tiếp
-    for i, listing_id in enumerate(listing_ids):
+def build_listing_record(listing_id, payload, error, stored=None, section_types=None):
+    # Chuyển kết quả fetch thành record lưu vào file output.
+    # Nếu có stored (record đã lưu) thì payload chỉ chứa section_types, được ghép vào record đó
+    if error is None:
         try:
-            hashes = extract_sha256_hashes(listing_id)
-            if hashes.get("StaysPdpSections") and hashes.get("stayCheckout"):
-                return hashes
+            sections, price_data = payload
+            if stored:
+                refreshed, handled = extract_listing_data(sections, price_data, listing_id, section_handlers(section_types))
+                # Section không có trong response giữ nguyên giá trị đã lưu
+                listing_data = {
+                    "listing_id": listing_id,
+                    "data": merge_listing_data(stored["data"], refreshed["data"], handled)
+                }
+                print(f"[SUCCESS] Refreshed listing info successfully for {listing_id}\n")
             else:
-                print(f"[WARNING] Not enough hashes from listing_id: {listing_id}")
+                listing_data, _ = extract_listing_data(sections, price_data, listing_id)
+                print(f"[SUCCESS] Got listing info successfully for {listing_id}\n")
         except Exception as e:
-            print(f"[ERROR] Error getting hash from listing_id {listing_id}: {e}")
-            continue
+            error = e
 
-    print("[ERROR] Could not get hash from any listing_id!")
-    return None
+    if error is not None:
+        print(f"[ERROR] Error fetching listing info for {listing_id}: {error}\n")
+        # Tạo listing_data rỗng để vẫn có thể thêm vào danh sách
+        listing_data = {
+            "listing_id": listing_id,
+            "data": {},
+            "error": str(error),
+            "transient": is_transient_failure(error),
+            "fetch_date": None
+        }
 
-def save_to_json(new_data, filename):
-    """Lưu dữ liệu vào file JSON, append IDs mới và ghi đè IDs đã có"""
-    try:
-        existing_data = []
-        
-        # Đọc dữ liệu hiện tại nếu file tồn tại
-        if os.path.exists(filename):
-            try:
-                with open(filename, 'r', encoding='utf-8') as f:
-                    existing_data = json.load(f)
-                    if not isinstance(existing_data, list):
-                        existing_data = []
-                print(f"[INFO] Found {len(existing_data)} existing records in {filename}")
-            except (json.JSONDecodeError, FileNotFoundError):
-                print(f"[WARNING] Could not read existing {filename}, starting fresh")
-                existing_data = []
-        
-        # Tạo dict để lookup existing data theo listing_id
-        existing_dict = {}
-        for item in existing_data:
-            if item and isinstance(item, dict) and 'listing_id' in item:
-                existing_dict[item['listing_id']] = item
-        
-        # Xử lý new data: thêm mới hoặc ghi đè
-        updated_count = 0
-        added_count = 0
-        
-        for item in new_data:
-            if item and isinstance(item, dict) and 'listing_id' in item:
-                listing_id = item['listing_id']
-                
-                if listing_id in existing_dict:
-                    # Ghi đè data cũ
-                    existing_dict[listing_id] = item
-                    updated_count += 1
-                    print(f"[UPDATE] Overwritten data for listing {listing_id}")
-                else:
-                    # Thêm mới
-                    existing_dict[listing_id] = item
-                    added_count += 1
-                    print(f"[NEW] Added new listing {listing_id}")
-        
-        # Convert dict back to list để maintain order
-        combined_data = list(existing_dict.values())
-        
-        # Ghi lại file với dữ liệu đã merge
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(combined_data, f, ensure_ascii=False, indent=2)
-        
-        print(f"[SUCCESS] Added {added_count} new records, updated {updated_count} existing records")
-        print(f"[INFO] Total records in file: {len(combined_data)}")
-        
-    except Exception as e:
-        print(f"[ERROR] Error saving file {filename}: {e}")
+    # Thêm timestamp
+    listing_data["fetch_date"] = datetime.now().isoformat()
+    return listing_data
 
-def process_listing_info(listing_ids, hashes, output_filename):
-    # Xử lý fetch listing info và price cho tất cả listing_ids
-    print(f"\n[INFO] Starting fetch listing info and price for {len(listing_ids)} listings...")
+def process_listing_info(listing_ids, hashes, output_filename, client, concurrency=1, province=None, use_calendar=False, frontier=None,
+                         completed=None, checkpoint_every=CHECKPOINT_EVERY, stored_records=None, section_types=None):
+    # Xử lý fetch listing info và price cho tất cả listing_ids.
+    # Listing có trong stored_records chỉ được lấy lại section_types rồi ghép vào record đã lưu
+    stored_records = stored_records or {}
+    print(f"\n[INFO] Starting fetch listing info and price for {len(listing_ids)} listings (concurrency={concurrency})...")
     
     listing_hash = hashes.get("StaysPdpSections")
     price_hash = hashes.get("stayCheckout")
@@ -119,39 +94,67 @@ def process_listing_info(listing_ids, hashes, output_filename):
         return
     if not price_hash:
         print("[WARNING] No hash found for stayCheckout, will skip price data")
+
+    # Chế độ dùng calendar để chọn ngày checkin hợp lệ trước khi gọi stayCheckout
+    calendar_hash = hashes.get("PdpAvailabilityCalendar") if use_calendar else None
+    if use_calendar and not calendar_hash:
+        print("[WARNING] No hash found for PdpAvailabilityCalendar, price dates will not use calendar")
     
-    new_listing_info = []
+    # Thống kê khoảng ngày có giá, dùng để sắp xếp thứ tự thử stayCheckout
+    probe_stats = ProbeStats.load()
+
+    def fetch(listing_id):
+        refresh_types = section_types if listing_id in stored_records else None
+        return fetch_listing_payload(listing_id, listing_hash, price_hash, client, probe_stats, province, calendar_hash, refresh_types)
+
+    def build(listing_id, payload, error):
+        stored = stored_records.get(listing_id)
+        return build_listing_record(listing_id, payload, error, stored, section_types if stored else None)
+
+    # Ghi ra file sau mỗi checkpoint_every listing; frontier chỉ được cập nhật khi record đã nằm trên đĩa
+    def on_flush(records):
+        probe_stats.save()
+        if frontier:
+            for record in records:
+                frontier.record_result(record["listing_id"], STAGE, record.get("error"), record.get("transient", False))
+                # Số review trên PDP, stage review dùng để bỏ qua listing không có review mới
+                review_count = record["data"].get("review_count")
+                if review_count is not None:
+                    frontier.record_review_count(record["listing_id"], review_count)
+
+    checkpointer = Checkpointer(JsonlWriter(output_filename), checkpoint_every, on_flush, completed, scope=province)
+    if checkpointer.completed:
+        listing_ids = [listing_id for listing_id in listing_ids if listing_id not in checkpointer.completed]
+        print(f"[INFO] Resuming: {len(checkpointer.completed)} listings already done, {len(listing_ids)} left")
     
-    for i, listing_id in enumerate(listing_ids):
-        print(f"[INFO] Fetching listing info and price {i+1}/{len(listing_ids)}: {listing_id}")
-        
-        listing_data = None
-        try:
-            encoded_id = encode_listing_id(listing_id)
-            sections = fetch_listing_info(listing_id, listing_hash, encoded_id, API_DOMAIN)
-            price_data = fetch_price(listing_id, price_hash, encoded_id, API_DOMAIN) if price_hash else None
-            listing_data = extract_listing_data(sections, price_data, listing_id)
-            print(f"[SUCCESS] Got listing info successfully for {listing_id}\n")
-        except Exception as e:
-            print(f"[ERROR] Error fetching listing info for {listing_id}: {e}\n")
-            # Tạo listing_data rỗng để vẫn có thể thêm vào danh sách
-            listing_data = {
-                "listing_id": listing_id,
-                "data": {},
-                "error": str(e),
-                "fetch_date": None
-            }
-        
-        if listing_data:
-            # Thêm timestamp
-            from datetime import datetime
-            listing_data["fetch_date"] = datetime.now().isoformat()
-            new_listing_info.append(listing_data)
+    if concurrency > 1:
+        done = 0
+
+        def on_result(index, listing_id, payload, error):
+            nonlocal done
+            done += 1
+            print(f"[INFO] Fetched listing info and price {done}/{len(listing_ids)}: {listing_id}")
+            checkpointer.add(build(listing_id, payload, error))
+
+        run_concurrently(listing_ids, fetch, concurrency, on_result)
+    else:
+        for i, listing_id in enumerate(listing_ids):
+            print(f"[INFO] Fetching listing info and price {i+1}/{len(listing_ids)}: {listing_id}")
+            try:
+                payload, error = fetch(listing_id), None
+            except Exception as e:
+                payload, error = None, e
+            checkpointer.add(build(listing_id, payload, error))
     
-    # Append vào file hiện tại thay vì ghi đè
-    save_to_json(new_listing_info, output_filename)
+    # Chốt lô cuối
+    checkpointer.finish()
+
+def load_stored_listings(listing_ids):
+    # Record listing info đã lưu (không lỗi) trong kho segment, dùng làm nền cho refresh một phần
+    stored = SegmentStore("listing_info").latest_for(listing_ids)
+    return {listing_id: record for listing_id, record in stored.items() if record.get("data") and not record.get("error")}
 
-def main(province=None):
+def main(province=None, concurrency=FETCH_CONCURRENCY, use_calendar=False, resume=False, refresh=False):
     print("=== FETCH LISTING INFO ===")
     
     # Kiểm tra xem province có được truyền vào không
@@ -162,17 +165,19 @@ def main(province=None):
         return
     
     print(f"[INFO] Processing province: {province}")
+    print(f"[INFO] Concurrency: {concurrency}, calendar-guided price dates: {use_calendar}, refresh: {refresh}")
     
+    frontier = Frontier()
     try:
-        # 1. Đọc listing_ids từ file
-        listing_ids = read_listing_ids(province)
+        # 1. Lấy các listing cần crawl từ frontier
+        listing_ids = frontier.pull(STAGE, province)
         if not listing_ids:
-            print("[ERROR] No listing IDs found to process!")
+            print("[INFO] No listings need work for this stage")
             return
         
         # 2. Lấy hash từ listing_id đầu tiên có thể
         print(f"\n[INFO] Fetching hash...")
-        hashes = get_valid_hashes(listing_ids)
+        hashes = get_valid_hashes(listing_ids, required=("StaysPdpSections", "stayCheckout"))
         if not hashes:
             print("[ERROR] No valid hash found, stopping program!")
             return
@@ -182,32 +187,66 @@ def main(province=None):
         output_dir = os.path.join(crawler_root, "output", "crawled_data")
         os.makedirs(output_dir, exist_ok=True)
         
-        # 4. Tạo date_sequence_number cho tên file output
-        date_sequence_number = generate_date_sequence_number("listing_info")
-        output_filename = os.path.join(output_dir, f"listing_info_{date_sequence_number}.json")
+        # 4. Chạy tiếp file output của lần chạy dở nếu --resume, ngược lại tạo file mới theo date_sequence_number
+        output_filename, completed = find_latest_checkpoint(output_dir, "listing_info", province) if resume else (None, set())
+        if output_filename is None:
+            if resume:
+                print("[INFO] No checkpoint to resume, starting a new run")
+            date_sequence_number = generate_date_sequence_number("listing_info")
+            output_filename = os.path.join(output_dir, f"listing_info_{date_sequence_number}.jsonl")
         print(f"[INFO] Output file will be: {output_filename}")
+
+        # Refresh: listing đã có trong kho segment chỉ lấy lại LISTING_REFRESH_SECTIONS và giá, listing mới vẫn lấy đầy đủ
+        stored_records = {}
+        if refresh:
+            if SEGMENT_STORE_ENABLED:
+                stored_records = load_stored_listings(listing_ids)
+                print(f"[INFO] Refreshing {LISTING_REFRESH_SECTIONS} + price for {len(stored_records)} stored listings, "
+                      f"{len(listing_ids) - len(stored_records)} new listings fetched in full")
+            else:
+                print("[WARNING] Refresh needs the segment store, fetching all listings in full")
         
-        # 5. Xử lý listing info
-        process_listing_info(listing_ids, hashes, output_filename)
+        # 5. Xử lý listing info (dùng chung một client để giữ kết nối keep-alive)
+        with CrawlerClient(raw_store=RawPayloadStore() if RAW_STORE_ENABLED else None,
+                           hash_registry=HashRegistry(hashes, listing_ids)) as client:
+            process_listing_info(listing_ids, hashes, output_filename, client, concurrency, province, use_calendar, frontier, completed,
+                                 stored_records=stored_records, section_types=LISTING_REFRESH_SECTIONS)
+            print(f"[INFO] Final request rates (req/s): {client.rates()}")
         print(f"[OUTPUT] File created: {output_filename}")
+
+        # 6. Gộp record trùng listing_id (vd. sau khi chạy tiếp bằng --resume), giữ record mới nhất
+        compact_jsonl(output_filename)
         
-        # 6. Upsert dữ liệu vào mysql/mongodb
+        # 7. Upsert dữ liệu vào mysql/mongodb
         print("\n=== UPSERTING LISTING INFO ===")
         from database.upsert_room_info import main as upsert_listing_info
         upsert_listing_info(output_filename)
         
         print("\n=== COMPLETED UPSERT LISTING INFO ===")
 
+        # 8. Chuyển file output thành segment của kho output, compact nền khi có nhiều segment
+        if SEGMENT_STORE_ENABLED:
+            store = SegmentStore("listing_info")
+            store.add_file(output_filename, compacted=True)
+            store.compact_in_background()
+
     except Exception as e:
         print(f"[ERROR] Error occurred during processing: {e}")
+    finally:
+        frontier.close()
 
 if __name__ == "__main__":
-    # Lấy province từ command line arguments
-    if len(sys.argv) < 2:
-        print("[ERROR] Province parameter is required!")
-        print("Usage: python run_fetch_listing_info.py <province_name>")
-        print("Example: python run_fetch_listing_info.py 'Ba Ria - Vung Tau'")
-        sys.exit(1)
-    
-    province = sys.argv[1]
-    main(province)
+    # Lấy province và các tuỳ chọn từ command line arguments
+    parser = argparse.ArgumentParser(description="Fetch listing info and price for a province")
+    parser.add_argument("province", help="Province name, e.g. 'Ba Ria - Vung Tau'")
+    parser.add_argument("concurrency", nargs="?", type=int, default=FETCH_CONCURRENCY,
+                        help="Number of listings fetched concurrently")
+    parser.add_argument("--use-calendar", action="store_true",
+                        help="Pick bookable checkin dates from each listing's calendar before calling stayCheckout")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue the last interrupted run for this province, skipping listings it already saved")
+    parser.add_argument("--refresh", action="store_true",
+                        help="Only re-fetch LISTING_REFRESH_SECTIONS and price for listings already in the segment store")
+    args = parser.parse_args()
+
+    main(args.province, args.concurrency, args.use_calendar, args.resume, args.refresh)
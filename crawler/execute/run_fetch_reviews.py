@@ -1,115 +1,34 @@
-import json
+import argparse
 import os
 import sys
-from datetime import datetime
 
 # Thêm thư mục cha vào Python path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from crawler.graphql_hashes import extract_sha256_hashes
-from crawler.fetch_reviews import fetch_reviews, extract_reviews_data
+from crawler.hash_cache import get_valid_hashes, HashRegistry
+from crawler.fetch_reviews import fetch_new_reviews, extract_reviews_data, merge_review_records
 from crawler.headers import encode_listing_id
-from crawler.config import API_DOMAIN
+from crawler.checkpoint import Checkpointer, find_latest_checkpoint
+from crawler.jsonl_output import JsonlWriter, compact_jsonl
+from crawler.frontier import Frontier
+from crawler.config import API_DOMAIN, CHECKPOINT_EVERY, RAW_STORE_ENABLED, REVIEW_SKIP_UNCHANGED_COUNT, SEGMENT_STORE_ENABLED
+from crawler.http_client import CrawlerClient, is_transient_failure
+from crawler.raw_store import RawPayloadStore
+from crawler.segment_store import SegmentStore
 from crawler.utils import generate_date_sequence_number
 
-def read_listing_ids(province):
-    # Đọc danh sách listing IDs từ file
-    listing_ids = []
-    
-    # Lấy đường dẫn tới thư mục gốc của crawler (thư mục cha của execute)
-    crawler_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    file_path = os.path.join(crawler_root, "output", "listing_ids", f"listing_ids_{province}.txt")
-    
-    if not os.path.exists(file_path):
-        print(f"[ERROR] File {file_path} is not found!")
-        return []
-    
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            for line in f:
-                line = line.strip()
-                if line:
-                    listing_ids.append(line)
-        print(f"[INFO] Read {len(listing_ids)} listing IDs from file")
-        return listing_ids
-    except Exception as e:
-        print(f"[ERROR] Error reading file: {e}")
-        return []
+# Tên stage trong frontier
+STAGE = "review"
+# Thời gian (ms) chờ MongoDB trả lời ping trước khi bỏ qua việc dừng phân trang theo review đã lưu
+MONGODB_PROBE_TIMEOUT_MS = 5000
 
-def get_valid_hashes(listing_ids):
-    # Lấy hash từ listing_id đầu tiên có thể, nếu lỗi thì thử tiếp
-    for i, listing_id in enumerate(listing_ids):
-        try:
-            hashes = extract_sha256_hashes(listing_id)
-            # Kiểm tra xem có lấy được hash cho reviews không
-            if hashes.get("StaysPdpReviewsQuery"):
-                return hashes
-            else:
-                print(f"[WARNING] No reviews hash from listing_id: {listing_id}")
-        except Exception as e:
-            print(f"[ERROR] Error getting hash from listing_id {listing_id}: {e}")
-            continue
-
-    print("[ERROR] Could not get hash from any listing_id!")
-    return None
-
-def save_to_json(new_data, filename):
-    """Lưu dữ liệu vào file JSON, append IDs mới và ghi đè IDs đã có"""
-    try:
-        existing_data = []
-        
-        # Đọc dữ liệu hiện tại nếu file tồn tại
-        if os.path.exists(filename):
-            try:
-                with open(filename, 'r', encoding='utf-8') as f:
-                    existing_data = json.load(f)
-                    if not isinstance(existing_data, list):
-                        existing_data = []
-                print(f"[INFO] Found {len(existing_data)} existing records in {filename}")
-            except (json.JSONDecodeError, FileNotFoundError):
-                print(f"[WARNING] Could not read existing {filename}, starting fresh")
-                existing_data = []
-        
-        # Tạo dict để lookup existing data theo listing_id
-        existing_dict = {}
-        for item in existing_data:
-            if item and isinstance(item, dict) and 'listing_id' in item:
-                existing_dict[item['listing_id']] = item
-        
-        # Xử lý new data: thêm mới hoặc ghi đè
-        updated_count = 0
-        added_count = 0
-        
-        for item in new_data:
-            if item and isinstance(item, dict) and 'listing_id' in item:
-                listing_id = item['listing_id']
-                
-                if listing_id in existing_dict:
-                    # Ghi đè data cũ
-                    existing_dict[listing_id] = item
-                    updated_count += 1
-                    print(f"[UPDATE] Overwritten reviews for listing {listing_id}")
-                else:
-                    # Thêm mới
-                    existing_dict[listing_id] = item
-                    added_count += 1
-                    print(f"[NEW] Added new reviews for listing {listing_id}")
-        
-        # Convert dict back to list để maintain order
-        combined_data = list(existing_dict.values())
-        
-        # Ghi lại file với dữ liệu đã merge
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(combined_data, f, ensure_ascii=False, indent=2)
-        
-        print(f"[SUCCESS] Added {added_count} new records, updated {updated_count} existing records")
-        print(f"[INFO] Total records in file: {len(combined_data)}")
-        
-    except Exception as e:
-        print(f"[ERROR] Error saving file {filename}: {e}")
-
-def process_reviews(listing_ids, hashes, output_filename):
-    # Xử lý fetch reviews cho tất cả listing_ids
+def process_reviews(listing_ids, hashes, output_filename, client, frontier=None, province=None, completed=None,
+                    checkpoint_every=CHECKPOINT_EVERY, known_review_ids=None):
+    # Xử lý fetch reviews cho tất cả listing_ids.
+    # known_review_ids(listing_id) trả về externalId đã lưu; reviews được lấy theo trang từ mới nhất
+    # và dừng ở review đã biết, record chỉ chứa review mới và được upsert theo kiểu ghép thêm.
+    # Listing chưa từng được lấy toàn bộ lịch sử (theo frontier) thì lấy toàn bộ một lần,
+    # vì reviews đã lưu bởi bản fetch một trang BEST_QUALITY cũ không liên tục theo thời gian
     print(f"\n[INFO] Starting fetch reviews for {len(listing_ids)} listings...")
     
     hash_val = hashes.get("StaysPdpReviewsQuery")
@@ -117,29 +36,61 @@ def process_reviews(listing_ids, hashes, output_filename):
         print("[ERROR] No hash found for StaysPdpReviewsQuery")
         return
     
-    all_reviews_data = []
+    # Ghi ra file sau mỗi checkpoint_every listing; frontier chỉ được cập nhật khi record đã nằm trên đĩa
+    def on_flush(records):
+        if frontier:
+            for record in records:
+                frontier.record_result(record["listing_id"], STAGE, record.get("error"), record.get("transient", False))
+                if record.get("error") is None:
+                    frontier.mark_reviews_crawled(record["listing_id"])
+                    if record.get("full_history"):
+                        frontier.mark_review_history_captured(record["listing_id"])
+
+    history_captured = frontier.review_history_captured(listing_ids) if frontier else None
+
+    checkpointer = Checkpointer(JsonlWriter(output_filename), checkpoint_every, on_flush, completed, scope=province)
+    if checkpointer.completed:
+        listing_ids = [listing_id for listing_id in listing_ids if listing_id not in checkpointer.completed]
+        print(f"[INFO] Resuming: {len(checkpointer.completed)} listings already done, {len(listing_ids)} left")
     
     for i, listing_id in enumerate(listing_ids):
         print(f"[INFO] Fetching reviews {i+1}/{len(listing_ids)}: {listing_id}")
         try:
             encoded_id = encode_listing_id(listing_id)
-            reviews_data = fetch_reviews(listing_id, hash_val, encoded_id, API_DOMAIN)
+            full_history = history_captured is not None and listing_id not in history_captured
+            known_ids = known_review_ids(listing_id) if known_review_ids and not full_history else set()
+            reviews_data = fetch_new_reviews(listing_id, hash_val, encoded_id, API_DOMAIN, client, known_ids)
             reviews_info = extract_reviews_data(reviews_data, listing_id)
-            all_reviews_data.append(reviews_info)
-            print(f"[SUCCESS] Got reviews successfully for {listing_id}\n")
+            reviews_info["merge"] = "append"
+            if full_history:
+                reviews_info["full_history"] = True
+            checkpointer.add(reviews_info)
+            print(f"[SUCCESS] Got {len(reviews_data)} new reviews for {listing_id} ({len(known_ids)} already stored)\n")
         except Exception as e:
             print(f"[ERROR] Error fetching reviews for {listing_id}: {e}\n")
             # Thêm entry rỗng để theo dõi
-            all_reviews_data.append({
+            checkpointer.add({
                 "listing_id": listing_id,
                 "reviews": [],
-                "error": str(e)
+                "error": str(e),
+                "transient": is_transient_failure(e)
             })
             continue
     
-    save_to_json(all_reviews_data, output_filename)
+    # Chốt lô cuối
+    checkpointer.finish()
+
+def skip_unchanged_listings(frontier, listing_ids):
+    # Bỏ các listing có số review trên PDP không đổi từ lần crawl reviews trước; đánh dấu fetched để tính lại hạn refetch
+    unchanged = frontier.unchanged_review_counts(listing_ids)
+    # Listing chưa lấy toàn bộ lịch sử reviews vẫn phải chạy một lần
+    unchanged &= frontier.review_history_captured(unchanged)
+    for listing_id in unchanged:
+        frontier.mark_fetched(listing_id, STAGE)
+    print(f"[INFO] Skipping {len(unchanged)} listings with unchanged review count")
+    return [listing_id for listing_id in listing_ids if listing_id not in unchanged]
 
-def main(province=None):
+def main(province=None, resume=False, check_count=REVIEW_SKIP_UNCHANGED_COUNT):
     print("=== FETCH REVIEWS ===")
     
     # Kiểm tra xem province có được truyền vào không
@@ -151,16 +102,19 @@ def main(province=None):
     
     print(f"[INFO] Processing province: {province}")
     
+    frontier = Frontier()
     try:
-        # 1. Đọc listing_ids từ file
-        listing_ids = read_listing_ids(province)
+        # 1. Lấy các listing cần crawl từ frontier
+        listing_ids = frontier.pull(STAGE, province)
+        if check_count:
+            listing_ids = skip_unchanged_listings(frontier, listing_ids)
         if not listing_ids:
-            print("[ERROR] No listing IDs found to process!")
+            print("[INFO] No listings need work for this stage")
             return
         
         # 2. Lấy hash từ listing_id đầu tiên có thể
         print(f"\n[INFO] Fetching hash...")
-        hashes = get_valid_hashes(listing_ids)
+        hashes = get_valid_hashes(listing_ids, required=("StaysPdpReviewsQuery",))
         if not hashes:
             print("[ERROR] No valid hash found, stopping program!")
             return
@@ -170,31 +124,63 @@ def main(province=None):
         output_dir = os.path.join(crawler_root, "output", "crawled_data")
         os.makedirs(output_dir, exist_ok=True)
         
-        # 4. Tạo date_sequence_number cho tên file output
-        date_sequence_number = generate_date_sequence_number("review")
-        output_filename = os.path.join(output_dir, f"review_{date_sequence_number}.json")
+        # 4. Chạy tiếp file output của lần chạy dở nếu --resume, ngược lại tạo file mới theo date_sequence_number
+        output_filename, completed = find_latest_checkpoint(output_dir, "review", province) if resume else (None, set())
+        if output_filename is None:
+            if resume:
+                print("[INFO] No checkpoint to resume, starting a new run")
+            date_sequence_number = generate_date_sequence_number("review")
+            output_filename = os.path.join(output_dir, f"review_{date_sequence_number}.jsonl")
         print(f"[INFO] Output file will be: {output_filename}")
         
-        # 5. Xử lý reviews
-        process_reviews(listing_ids, hashes, output_filename)
+        # 5. Xử lý reviews (dùng chung một client để giữ kết nối keep-alive).
+        # Review đã có trong MongoDB dùng để dừng phân trang; không kết nối được thì lấy toàn bộ, upsert sẽ bỏ review trùng
+        from database.upsert_room_review import connect_to_mongodb, get_known_review_ids, get_product_ids
+        mongodb_db = connect_to_mongodb(server_selection_timeout_ms=MONGODB_PROBE_TIMEOUT_MS)
+        if mongodb_db is None:
+            print("[WARNING] MongoDB unavailable, fetching full review history for every listing")
+            known_review_ids = None
+        else:
+            # ProductID của cả lô được lấy một lần, không mở kết nối MySQL cho từng listing
+            product_ids = get_product_ids(listing_ids)
+            known_review_ids = lambda listing_id: get_known_review_ids(mongodb_db, product_ids.get(listing_id), listing_id)
+
+        with CrawlerClient(raw_store=RawPayloadStore() if RAW_STORE_ENABLED else None,
+                           hash_registry=HashRegistry(hashes, listing_ids)) as client:
+            process_reviews(listing_ids, hashes, output_filename, client, frontier, province, completed,
+                            known_review_ids=known_review_ids)
+            print(f"[INFO] Final request rates (req/s): {client.rates()}")
         print("\n=== COMPLETED FETCH REVIEWS ===")
         print(f"File created: {output_filename}")
+
+        # 6. Gộp record trùng listing_id (vd. sau khi chạy tiếp bằng --resume), giữ record mới nhất
+        compact_jsonl(output_filename)
         
-        # 6. Upsert dữ liệu vào mongodb
+        # 7. Upsert dữ liệu vào mongodb
         from database.upsert_room_review import main as upsert_reviews
         upsert_reviews(output_filename)
         print("\n=== COMPLETED UPSERT REVIEWS ===")
+
+        # 8. Chuyển file output thành segment của kho output, compact nền khi có nhiều segment
+        if SEGMENT_STORE_ENABLED:
+            # Record trong file chỉ chứa review mới, segment lưu toàn bộ reviews sau khi ghép
+            store = SegmentStore("review")
+            store.add_file(output_filename, compacted=True, merge=merge_review_records)
+            store.compact_in_background()
         
     except Exception as e:
         print(f"[ERROR] Error occurred during processing: {e}")
+    finally:
+        frontier.close()
 
 if __name__ == "__main__":
-    # Lấy province từ command line arguments
-    if len(sys.argv) < 2:
-        print("[ERROR] Province parameter is required!")
-        print("Usage: python run_fetch_reviews.py <province_name>")
-        print("Example: python run_fetch_reviews.py 'Ba Ria - Vung Tau'")
-        sys.exit(1)
-    
-    province = sys.argv[1]
-    main(province)
+    # Lấy province và các tuỳ chọn từ command line arguments
+    parser = argparse.ArgumentParser(description="Fetch reviews for a province")
+    parser.add_argument("province", help="Province name, e.g. 'Ba Ria - Vung Tau'")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue the last interrupted run for this province, skipping listings it already saved")
+    parser.add_argument("--all", action="store_true",
+                        help="Fetch reviews even for listings whose review count has not changed")
+    args = parser.parse_args()
+
+    main(args.province, args.resume, check_count=REVIEW_SKIP_UNCHANGED_COUNT and not args.all)
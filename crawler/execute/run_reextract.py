@@ -0,0 +1,155 @@
+import argparse
+import os
+import sys
+from multiprocessing import Pool, cpu_count
+
+# Thêm thư mục cha vào Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crawler.fetch_listing_info import (extract_listing_data, merge_listing_data, parse_listing_info_response, parse_price_response,
+                                        requested_section_types, section_handlers)
+from crawler.fetch_reviews import extract_reviews_data, parse_reviews_response
+from crawler.jsonl_output import JsonlWriter
+from crawler.config import SEGMENT_STORE_ENABLED
+from crawler.raw_store import RawPayloadStore, DEFAULT_RAW_STORE_DIR
+from crawler.segment_store import SegmentStore
+from crawler.utils import generate_date_sequence_number
+
+# Mỗi process mở kết nối riêng tới index của raw store
+_store = None
+
+def _init_worker(store_dir):
+    global _store
+    _store = RawPayloadStore(store_dir)
+
+def reextract_listing_info(listing_id):
+    # Dựng lại record listing info từ response StaysPdpSections đầy đủ mới nhất,
+    # ghép thêm các response refresh một phần (sectionIds) mới hơn,
+    # và response stayCheckout mới nhất có giá
+    full = None
+    partials = []
+    for fetch_time, sha256, variables in _store.history(listing_id, "StaysPdpSections"):
+        section_types = requested_section_types(variables)
+        if section_types is None:
+            full = (fetch_time, sha256)
+            break
+        partials.append((fetch_time, sha256, section_types))
+    if not full:
+        return None
+    fetch_time, sha256 = full
+
+    price_data = []
+    for _, price_sha256, _ in _store.history(listing_id, "stayCheckout"):
+        price_data = parse_price_response(_store.get_json(price_sha256))
+        if price_data:
+            break
+
+    sections = parse_listing_info_response(_store.get_json(sha256))
+    listing_data, _ = extract_listing_data(sections, price_data, listing_id)
+    # Áp các lần refresh từ cũ đến mới
+    for fetch_time, partial_sha256, section_types in reversed(partials):
+        refreshed, handled = extract_listing_data(parse_listing_info_response(_store.get_json(partial_sha256)), None,
+                                                  listing_id, section_handlers(section_types))
+        listing_data["data"] = merge_listing_data(listing_data["data"], refreshed["data"], handled)
+    listing_data["fetch_date"] = fetch_time
+    return listing_data
+
+def reextract_reviews(listing_id):
+    # Dựng lại record reviews từ tất cả response StaysPdpReviewsQuery đã lưu (mỗi lần chạy có thể gồm nhiều trang),
+    # bỏ review trùng. Record chứa toàn bộ lịch sử nên được upsert thay thế document đã lưu,
+    # để bản extract đã sửa cập nhật cả các review đã có
+    history = _store.history(listing_id, "StaysPdpReviewsQuery")
+    if not history:
+        return None
+    reviews = []
+    seen = set()
+    for _, sha256, _ in history:
+        for review in parse_reviews_response(_store.get_json(sha256)):
+            if review.get("id") in seen:
+                continue
+            seen.add(review.get("id"))
+            reviews.append(review)
+    # history() trả về theo fetch_time, không theo thứ tự trang: sắp xếp lại mới nhất trước như khi crawl
+    reviews.sort(key=lambda review: review.get("createdAt") or "", reverse=True)
+    return extract_reviews_data(reviews, listing_id)
+
+# kind -> (operation chính, hàm xử lý lại, data_type cho sequence, tiền tố file output)
+REEXTRACTORS = {
+    "listing_info": ("StaysPdpSections", reextract_listing_info, "listing_info", "listing_info"),
+    "review": ("StaysPdpReviewsQuery", reextract_reviews, "review", "review")
+}
+
+def reextract(kind, output_filename, store_dir=DEFAULT_RAW_STORE_DIR, workers=None, listing_ids=None):
+    # Chạy lại extract trên raw payload, song song trên tất cả CPU, không gọi mạng.
+    # Record được ghi thẳng ra file JSON Lines ngay khi có, trả về số record đã ghi
+    operation, worker, _, _ = REEXTRACTORS[kind]
+    if listing_ids is None:
+        store = RawPayloadStore(store_dir)
+        listing_ids = store.listing_ids(operation)
+        store.close()
+
+    workers = workers or cpu_count()
+    print(f"[INFO] Re-extracting {kind} for {len(listing_ids)} listings with {workers} processes...")
+
+    written = 0
+    errors = 0
+    with Pool(processes=workers, initializer=_init_worker, initargs=(store_dir,)) as pool, JsonlWriter(output_filename) as writer:
+        for i, result in enumerate(pool.imap_unordered(_safe_call, [(kind, lid) for lid in listing_ids], chunksize=64)):
+            listing_id, record, error = result
+            if error:
+                errors += 1
+                print(f"[ERROR] Error re-extracting {kind} for {listing_id}: {error}")
+            elif record:
+                writer.write(record)
+                written += 1
+            if (i + 1) % 1000 == 0:
+                print(f"[INFO] Re-extracted {i+1}/{len(listing_ids)}")
+
+    print(f"[INFO] Re-extracted {written} records, {errors} errors")
+    return written
+
+def _safe_call(args):
+    kind, listing_id = args
+    try:
+        return listing_id, REEXTRACTORS[kind][1](listing_id), None
+    except Exception as e:
+        return listing_id, None, str(e)
+
+def main(kind, upsert=False, workers=None):
+    print(f"=== RE-EXTRACT {kind.upper()} FROM RAW PAYLOADS ===")
+
+    # Ghi ra file output cùng định dạng với lần crawl bình thường
+    _, _, data_type, prefix = REEXTRACTORS[kind]
+    crawler_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output_dir = os.path.join(crawler_root, "output", "crawled_data")
+    os.makedirs(output_dir, exist_ok=True)
+    output_filename = os.path.join(output_dir, f"{prefix}_{generate_date_sequence_number(data_type)}.jsonl")
+
+    if not reextract(kind, output_filename, workers=workers):
+        print("[WARNING] No records re-extracted!")
+        return
+    print(f"[OUTPUT] File created: {output_filename}")
+
+    if upsert:
+        if kind == "listing_info":
+            print("\n=== UPSERTING LISTING INFO ===")
+            from database.upsert_room_info import main as upsert_main
+        else:
+            print("\n=== UPSERTING REVIEWS ===")
+            from database.upsert_room_review import main as upsert_main
+        upsert_main(output_filename)
+
+    # Bản dựng lại trở thành segment mới nhất của kho output
+    if SEGMENT_STORE_ENABLED:
+        store = SegmentStore(kind)
+        store.add_file(output_filename)
+        store.compact_in_background()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-run extraction over stored raw GraphQL payloads (no network)")
+    parser.add_argument("kind", choices=sorted(REEXTRACTORS), help="Which output to rebuild")
+    parser.add_argument("--upsert", action="store_true", help="Push the rebuilt output to the upsert stage")
+    parser.add_argument("--workers", type=int, default=None, help="Number of processes (default: all cores)")
+    args = parser.parse_args()
+
+    main(args.kind, args.upsert, args.workers)